@@ -0,0 +1,81 @@
+# B E N C H .
+
+""" Searches a fixed set of positions to a fixed depth and reports the node counts and speed as JSON. The total node
+    count is a signature of the search: it only changes when the search itself changes.
+
+    Usage: python bench.py [--depth N] [--hash MB] [--output FILE]
+"""
+
+import argparse
+import json
+import time
+from engine import *
+
+# Bench positions, given as (name, FEN string) pairs.
+BENCH_POSITIONS = (
+    ('ruy lopez', 'r1bq1rk1/2p1bppp/p1np1n2/1p2p3/4P3/1BP2N1P/PP1P1PP1/RNBQR1K1 b - - 0 9'),
+    ('queens gambit declined', 'r1bq1rk1/pp1nbppp/2p1pn2/6B1/2BP4/2N1PN2/PP3PPP/2RQK2R b K - 0 9'),
+    ('sicilian najdorf', 'r2q1rk1/1p1nbppp/p2pbn2/4p3/4P3/1NN1BP2/PPPQ2PP/2KR1B1R w - - 5 11'),
+    ('kings indian', 'r1bq1rk1/ppp1npbp/3p1np1/3Pp3/2P1P3/2N2N2/PP2BPPP/R1BQ1RK1 w - - 1 9'),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1'),
+    ('rook against bishop', '3k4/1p5p/4p2p/2P5/P3p2P/8/3b1P1R/5K2 w - - 1 41'),
+    ('rook and pawns', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1'),
+    ('lucena', '1K1k4/1P6/8/8/8/8/r7/2R5 w - - 0 1'),
+    ('fine 70', '8/k7/3p4/p2P1p2/P2P1P2/8/8/K7 w - - 0 1'),
+)
+
+
+def runBench(depth, hash_size=HASH_SIZE):
+    """ Searches every bench position to depth with a fresh board and engine. Returns the results as a
+        dictionary.
+    """
+    rules = Rules()
+    results = []
+
+    for name, fen in BENCH_POSITIONS:
+        board = Board(fen=fen)
+        player = board.getSideToMove()
+        engine = Engine(hash_size)
+
+        start = time.time()
+        pv = engine.iterativeDeepening(board, rules, player, depth)
+        elapsed = time.time() - start
+
+        nodes = engine.getNodeCount()
+        results.append({'name': name,
+                        'nodes': nodes,
+                        'quiescence_nodes': engine.getQuiescenceNodeCount(),
+                        'time': round(elapsed, 3),
+                        'nps': int(nodes / elapsed) if elapsed else 0,
+                        'best_move': moveNotation(pv[0]) if pv else None})
+
+    total_nodes = sum(result['nodes'] for result in results)
+    quiescence_nodes = sum(result['quiescence_nodes'] for result in results)
+    total_time = sum(result['time'] for result in results)
+    return {'depth': depth,
+            'hash_size': hash_size,
+            'positions': results,
+            'total_nodes': total_nodes,
+            'quiescence_nodes': quiescence_nodes,
+            'total_time': round(total_time, 3),
+            'nps': int(total_nodes / total_time) if total_time else 0,
+            'signature': total_nodes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search the bench positions and report nodes and speed.')
+    parser.add_argument('--depth', type=int, default=4, help='search depth in plies')
+    parser.add_argument('--hash', type=int, default=HASH_SIZE, help='transposition table size in megabytes')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    report = json.dumps(runBench(args.depth, args.hash), indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+# O P E N I N G   B O O K .
+
+""" A binary opening book in a Polyglot-like layout: 16-byte records of position key, move, weight and a spare
+    field, big-endian and sorted by position key. The file is memory-mapped and searched in place, so opening it
+    costs nothing and processes that open the same book share its pages. Keys are the engine's own Zobrist keys and
+    moves are move keys (origin square << 7 | target square), so books are not interchangeable with Polyglot ones.
+
+    Builds a book from PGN files:
+
+    Usage: python book.py PGN [PGN ...] [--output FILE] [--plies N] [--min-weight N]
+"""
+
+import argparse
+import mmap
+import random
+import re
+import struct
+from engine import *
+
+# Record layout: position key, move key, weight, spare.
+BOOK_RECORD = struct.Struct('>QHHI')
+
+
+class OpeningBook(object):
+
+    def __init__(self, path):
+        """ Opens the book file at path. Raises IOError if it can't be read. """
+        self.book_file = open(path, 'rb')
+        self.book_file.seek(0, 2)
+        size = self.book_file.tell()
+        self.records = size // BOOK_RECORD.size
+
+        # Empty files can't be mapped.
+        self.memory = None
+        if self.records:
+            self.memory = mmap.mmap(self.book_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.random = random.Random()
+
+    def close(self):
+        """ Closes the book file. """
+        if self.memory is not None:
+            self.memory.close()
+        self.book_file.close()
+
+    def getSize(self):
+        """ Returns the number of records in the book. """
+        return self.records
+
+    def probe(self, hash_key):
+        """ Returns a list of (move key, weight) pairs for the position. """
+        # Binary search for the first record of the position.
+        low = 0
+        high = self.records
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from('>Q', self.memory, middle * BOOK_RECORD.size)[0] < hash_key:
+                low = middle + 1
+            else:
+                high = middle
+
+        entries = []
+        while low < self.records:
+            key, move_key, weight, spare = BOOK_RECORD.unpack_from(self.memory, low * BOOK_RECORD.size)
+            if key != hash_key:
+                break
+            entries.append((move_key, weight))
+            low += 1
+
+        return entries
+
+    def chooseMove(self, board, rules, player):
+        """ Returns a legal book move for the position, picked at random by weight, or None if the position isn't
+            in the book.
+        """
+        moves = []
+        total_weight = 0
+        for move_key, weight in self.probe(board.getHashKey()):
+            move = board.createMove(move_key >> 7, move_key & 0x7f, player)
+            if weight and rules.isPseudoLegal(move, board, player) and rules.isLegal(move, board, player):
+                moves.append((move, weight))
+                total_weight += weight
+
+        if not moves:
+            return None
+
+        choice = self.random.randrange(total_weight)
+        for move, weight in moves:
+            choice -= weight
+            if choice < 0:
+                return move
+
+
+def parseSan(board, rules, san, player):
+    """ Returns the legal move for a move in standard algebraic notation, or None. """
+    san = san.rstrip('+#!?').replace('0', 'O').replace('=', '')
+    check_info = rules.getCheckInfo(board, player)
+    moves = board.generateCaptures(rules, player, check_info)
+    moves.extend(board.generateNonCaptures(rules, player, check_info))
+    for move in moves:
+        if board.getSan(rules, move, player).replace('=', '') == san:
+            return move
+    return None
+
+
+def readGames(pgn_file):
+    """ Yields a (result, list of SAN moves) pair for every game in a PGN file. """
+    result = '*'
+    movetext = []
+    in_comment = False  # Inside a { } comment, which can span lines.
+
+    for line in pgn_file:
+        line = line.strip()
+        if line.startswith('[') and not in_comment:
+            # A tag after movetext starts the next game.
+            if movetext:
+                yield result, parseMovetext(' '.join(movetext))
+                movetext = []
+                result = '*'
+            match = re.match(r'\[Result\s+"(.*)"\]', line)
+            if match:
+                result = match.group(1)
+        elif line and not line.startswith('%'):
+            line, in_comment = stripLineComment(line, in_comment)
+            movetext.append(line)
+
+    if movetext:
+        yield result, parseMovetext(' '.join(movetext))
+
+
+def stripLineComment(line, in_comment):
+    """ Returns the movetext line without its ; comment, which runs to the end of the line, and whether a { }
+        comment is open at the end of the line. in_comment tells if one was open at its start.
+    """
+    for index, char in enumerate(line):
+        if in_comment:
+            in_comment = char != '}'
+        elif char == '{':
+            in_comment = True
+        elif char == ';':
+            return line[:index], False
+    return line, in_comment
+
+
+def parseMovetext(movetext):
+    """ Returns the list of the SAN moves of a game's main line. The lines of the movetext are joined, so ;
+        comments must already be gone.
+    """
+    movetext = re.sub(r'\{[^}]*\}', ' ', movetext)  # Comments.
+
+    # Variations can be nested, so they are taken out from the inside.
+    while '(' in movetext:
+        stripped = re.sub(r'\([^()]*\)', ' ', movetext)
+        if stripped == movetext:
+            break
+        movetext = stripped
+
+    moves = []
+    for token in movetext.split():
+        token = re.sub(r'^\d+\.+', '', token)  # Move numbers.
+        if token and not token.startswith('$') and token not in ('1-0', '0-1', '1/2-1/2', '*'):
+            moves.append(token)
+    return moves
+
+
+def buildBook(pgn_paths, output_path, plies=BOOK_PLIES, min_weight=1):
+    """ Writes a book of the first plies moves of the games in the PGN files. A move's weight is 2 for every game
+        the side playing it won, 1 for every draw and game without a result and 0 for every loss. Moves with less
+        than min_weight are left out, so with the default of 1 a move only played in lost games isn't in the book.
+        A weight of 0 would never be chosen anyway. Returns the number of records written.
+    """
+    rules = Rules()
+    weights = {}
+    result_weights = {'1-0': {WHITE: 2, BLACK: 0}, '0-1': {WHITE: 0, BLACK: 2}}
+
+    for path in pgn_paths:
+        with open(path) as pgn_file:
+            for result, moves in readGames(pgn_file):
+                board = Board()
+                player = board.getWhitePlayer()
+                for san in moves[:plies]:
+                    move = parseSan(board, rules, san, player)
+                    if not move:
+                        break  # Illegal or unsupported move, like an underpromotion.
+
+                    record = (board.getHashKey(), move & 0x3fff)
+                    weight = result_weights.get(result, {WHITE: 1, BLACK: 1})[player.getColor()]
+                    weights[record] = weights.get(record, 0) + weight
+
+                    board.makeMove(move, player)
+                    player = board.getOtherPlayer(player)
+
+    records = sorted(record for record in weights if weights[record] >= min_weight)
+    with open(output_path, 'wb') as book_file:
+        for hash_key, move_key in records:
+            book_file.write(BOOK_RECORD.pack(hash_key, move_key, min(weights[hash_key, move_key], 0xffff), 0))
+
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build an opening book from PGN files.')
+    parser.add_argument('pgn', nargs='+', help='PGN files of the games')
+    parser.add_argument('--output', default=BOOK_FILE, help='book file to write (default: %s)' % BOOK_FILE)
+    parser.add_argument('--plies', type=int, default=BOOK_PLIES, help='number of plies of every game to use')
+    parser.add_argument('--min-weight', type=int, default=1,
+                        help='smallest weight of a move in the book; moves only played in lost games weigh 0')
+    args = parser.parse_args()
+
+    records = buildBook(args.pgn, args.output, args.plies, args.min_weight)
+    print('records: %d' % records)
+
+
+if __name__ == '__main__':
+    main()
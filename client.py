@@ -1,14 +1,23 @@
 # C H E S S  E N G I N E.
 
+import os
 import pygame, sys
 from pygame.locals import *
 from engine import *
+from book import OpeningBook
+from smp import ParallelEngine
+from tablebase import Tablebase
 
 class Game(object):
 
     def __init__(self):
         self.board = Board()
-        self.engine = Engine()
+        book = OpeningBook(BOOK_FILE) if os.path.exists(BOOK_FILE) else None
+        tablebase = Tablebase(TABLEBASE_FILE) if os.path.exists(TABLEBASE_FILE) else None
+        if SEARCH_PROCESSES > 1:
+            self.engine = ParallelEngine(processes=SEARCH_PROCESSES, book=book, tablebase=tablebase)
+        else:
+            self.engine = Engine(book=book, tablebase=tablebase)
         self.rules = Rules()
 
     def screenToBoard(self, coordinates):
@@ -32,12 +41,9 @@ class Game(object):
 
     def checkPromotionPic(self, move, player):
         """ If move is promotion, loads the new piece's picture. """
-        if move.getSpecialMove() == PROMOTION:
-            new_piece = self.board.getPiece(move.getTargetSquare())
-            if player.getColor() == WHITE:
-                new_piece.loadImage(pygame.image.load('graphics/white_queen.png'))
-            else:
-                new_piece.loadImage(pygame.image.load('graphics/black_queen.png'))
+        if moveSpecial(move) == PROMOTION:
+            new_piece = self.board.getPiece(moveTarget(move))
+            new_piece.loadImage(pygame.image.load(new_piece.getGraphicsPath()))
 
     def gameLoop(self):
         """ Runs the game. """
@@ -48,47 +54,17 @@ class Game(object):
         chosen_piece = None
         mouse_clicked = False
         game_over = False
-        turn = white_player
+        turn = self.board.getWhitePlayer()
 
         screen = pygame.display.set_mode((window_size, window_size), 0, 32)
         pygame.display.set_caption('Sten\'s chess engine')
         font = pygame.font.SysFont('comicsansms', 70)
         
-        # Load white pieces. 
-        white_pawn1.loadImage(pygame.image.load('graphics/white_pawn.png'))
-        white_pawn2.loadImage(pygame.image.load('graphics/white_pawn.png'))
-        white_pawn3.loadImage(pygame.image.load('graphics/white_pawn.png'))
-        white_pawn4.loadImage(pygame.image.load('graphics/white_pawn.png'))
-        white_pawn5.loadImage(pygame.image.load('graphics/white_pawn.png'))
-        white_pawn6.loadImage(pygame.image.load('graphics/white_pawn.png'))
-        white_pawn7.loadImage(pygame.image.load('graphics/white_pawn.png'))
-        white_pawn8.loadImage(pygame.image.load('graphics/white_pawn.png'))
-        white_knight1.loadImage(pygame.image.load('graphics/white_knight.png'))
-        white_knight2.loadImage(pygame.image.load('graphics/white_knight.png'))
-        white_bishop1.loadImage(pygame.image.load('graphics/white_bishop.png'))
-        white_bishop2.loadImage(pygame.image.load('graphics/white_bishop.png'))
-        white_rook1.loadImage(pygame.image.load('graphics/white_rook.png'))
-        white_rook2.loadImage(pygame.image.load('graphics/white_rook.png'))
-        white_queen.loadImage(pygame.image.load('graphics/white_queen.png'))
-        white_king.loadImage(pygame.image.load('graphics/white_king.png'))
-        
-        # Load black pieces.
-        black_pawn1.loadImage(pygame.image.load('graphics/black_pawn.png'))
-        black_pawn2.loadImage(pygame.image.load('graphics/black_pawn.png'))
-        black_pawn3.loadImage(pygame.image.load('graphics/black_pawn.png'))
-        black_pawn4.loadImage(pygame.image.load('graphics/black_pawn.png'))
-        black_pawn5.loadImage(pygame.image.load('graphics/black_pawn.png'))
-        black_pawn6.loadImage(pygame.image.load('graphics/black_pawn.png'))
-        black_pawn7.loadImage(pygame.image.load('graphics/black_pawn.png'))
-        black_pawn8.loadImage(pygame.image.load('graphics/black_pawn.png'))
-        black_knight1.loadImage(pygame.image.load('graphics/black_knight.png'))
-        black_knight2.loadImage(pygame.image.load('graphics/black_knight.png'))
-        black_bishop1.loadImage(pygame.image.load('graphics/black_bishop.png'))
-        black_bishop2.loadImage(pygame.image.load('graphics/black_bishop.png'))
-        black_rook1.loadImage(pygame.image.load('graphics/black_rook.png'))
-        black_rook2.loadImage(pygame.image.load('graphics/black_rook.png'))
-        black_queen.loadImage(pygame.image.load('graphics/black_queen.png'))
-        black_king.loadImage(pygame.image.load('graphics/black_king.png'))
+        # Load the piece images.
+        for player in self.board.getWhitePlayer(), self.board.getBlackPlayer():
+            for piece_type in player.getPieceDict():
+                for piece in player.getPieceDict()[piece_type]:
+                    piece.loadImage(pygame.image.load(piece.getGraphicsPath()))
 
         # Load empty squares.
         blank_squares = pygame.image.load('graphics/white.png'), pygame.image.load('graphics/black.png')
@@ -96,6 +72,8 @@ class Game(object):
         while True:
             for event in pygame.event.get():
                 if event.type == QUIT:
+                    if isinstance(self.engine, ParallelEngine):
+                        self.engine.close()
                     pygame.quit()
                     sys.exit()
 
@@ -103,6 +81,15 @@ class Game(object):
                     pos = self.screenToBoard(event.pos)
                     mouse_clicked = True
 
+                # Backspace takes back the last move, and the computer's reply, so it's the human's turn again.
+                if event.type == KEYDOWN and event.key == K_BACKSPACE:
+                    if self.board.takeBack() is not None:
+                        if self.board.getSideToMove().getType() == COMPUTER:
+                            self.board.takeBack()
+                        turn = self.board.getSideToMove()
+                        chosen_piece = None
+                        game_over = False
+
             
             if turn.getType() == HUMAN and mouse_clicked and not game_over:
                 if self.board.getPiece(pos) and self.board.getPiece(pos).getColor() == turn.getColor():
@@ -111,17 +98,17 @@ class Game(object):
                 elif chosen_piece:
                     origin_square = chosen_piece.getPosition()
                     target_square = pos
-                    move = self.board.createMoveObject(origin_square, target_square, turn)
+                    move = self.board.createMove(origin_square, target_square, turn)
                     if self.rules.isPseudoLegal(move, self.board, turn):
                         if self.rules.isLegal(move, self.board, turn):
-                            if move.getSpecialMove() == SHORT_CASTLE:
+                            if moveSpecial(move) == SHORT_CASTLE:
                                 print('white: 0-0')
-                            elif move.getSpecialMove() == LONG_CASTLE:
+                            elif moveSpecial(move) == LONG_CASTLE:
                                 print('white: 0-0-0')
-                            elif move.getSpecialMove() == PROMOTION:
-                                print('white: ' + self.boardToChess(move.getOriginSquare()) + '-' + self.boardToChess(move.getTargetSquare()) + '(Q)')
+                            elif moveSpecial(move) == PROMOTION:
+                                print('white: ' + self.boardToChess(moveOrigin(move)) + '-' + self.boardToChess(moveTarget(move)) + '(Q)')
                             else:
-                                print('white: ' + self.boardToChess(move.getOriginSquare()) + '-' + self.boardToChess(move.getTargetSquare()))
+                                print('white: ' + self.boardToChess(moveOrigin(move)) + '-' + self.boardToChess(moveTarget(move)))
                             self.board.makeMove(move, turn)
                             self.checkPromotionPic(move, turn)  # Load a new picture if a piece was promoted.                           
                             turn = self.board.getOtherPlayer(turn)
@@ -131,14 +118,14 @@ class Game(object):
 
             elif turn.getType() == COMPUTER and not game_over:
                 move = self.engine.iterativeDeepening(self.board, self.rules, turn)[0]
-                if move.getSpecialMove() == SHORT_CASTLE:
+                if moveSpecial(move) == SHORT_CASTLE:
                     print('black: 0-0')
-                elif move.getSpecialMove() == LONG_CASTLE:
+                elif moveSpecial(move) == LONG_CASTLE:
                     print('black: 0-0-0')
-                elif move.getSpecialMove() == PROMOTION:
-                    print('black: ' + self.boardToChess(move.getOriginSquare()) + '-' + self.boardToChess(move.getTargetSquare()) + '(Q)')
+                elif moveSpecial(move) == PROMOTION:
+                    print('black: ' + self.boardToChess(moveOrigin(move)) + '-' + self.boardToChess(moveTarget(move)) + '(Q)')
                 else:
-                    print('black: ' + self.boardToChess(move.getOriginSquare()) + '-' + self.boardToChess(move.getTargetSquare()))
+                    print('black: ' + self.boardToChess(moveOrigin(move)) + '-' + self.boardToChess(moveTarget(move)))
                 self.board.makeMove(move, turn)
                 self.checkPromotionPic(move, turn)  # Load a new picture if a piece was promoted.
                 turn = self.board.getOtherPlayer(turn)
@@ -153,10 +140,7 @@ class Game(object):
 
             # Put all the pieces on the board.
             for color in WHITE, BLACK:
-                if color == WHITE:
-                    player = white_player
-                else:
-                    player = black_player
+                player = self.board.getPlayer(color)
 
                 for piece_type in player.getPieceDict():
                     for piece in player.getPieceDict()[piece_type]:
@@ -174,7 +158,7 @@ class Game(object):
                 pygame.draw.rect(screen, (255, 255, 0), origin_rect, 2)
                 screen.unlock()
                 for move in valid_moves:
-                    x, y = self.boardToScreen(move.getTargetSquare(), square_size)
+                    x, y = self.boardToScreen(moveTarget(move), square_size)
                     target_rect = x, y, square_size, square_size
                     screen.lock()
                     pygame.draw.rect(screen, (255, 255, 0), target_rect, 2)
@@ -198,7 +182,7 @@ class Game(object):
                 screen.blit(text, text_rect)
                 game_over = True
 
-            elif self.rules.isMaterialDraw():
+            elif self.rules.isMaterialDraw(self.board):
                 # pygame.display.set_caption('Draw!')
                 text = font.render('Draw!', True, (255, 215, 0))
                 text_rect = text.get_rect()
@@ -42,12 +42,74 @@ QUEEN_VALUE = 900
 KING_VALUE = 20000
 DRAW_VALUE = 0
 MATE_VALUE = 100000
+MATE_BOUND = MATE_VALUE - 1000  # Scores beyond this are mate scores.
+
+# Pawn structure constants, as (middle game, end game) pairs. Passed pawn bonuses are by rank, from the player's
+# own side.
+DOUBLED_PAWN_PENALTY = (10, 20)  # For every pawn behind another one of the same color on its file.
+ISOLATED_PAWN_PENALTY = (10, 15)  # For every pawn without pawns of the same color on the adjacent files.
+PASSED_PAWN_BONUS = ((0, 0), (5, 10), (5, 15), (10, 25), (20, 40), (35, 65), (60, 100), (0, 0))
+BLOCKED_PASSED_PAWN_PENALTY = (5, 20)  # For every passed pawn with a piece on the square in front of it.
 
 # Special move constants.
-EN_PASSANT = 'en passant'
-SHORT_CASTLE = 'short castle'
-LONG_CASTLE = 'long castle'
-PROMOTION = 'promotion'
+EN_PASSANT = 1
+SHORT_CASTLE = 2
+LONG_CASTLE = 3
+PROMOTION = 4
+
+# Packed move masks. A move with none of the captured piece (bits 20-23) and promoted piece (bits 17-19) bits set is
+# quiet; castling is quiet too.
+QUIET_MOVE_MASK = 0xf << 20 | 0x7 << 17
+
+# Transposition table constants.
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+HASH_SIZE = 16  # Default size of the transposition table in megabytes.
+PAWN_HASH_SIZE = 1  # Size of the pawn hash table in megabytes.
+PERFT_HASH_SIZE = 16  # Size of the perft subtree count table in megabytes.
+
+# Search limit constants.
+DEFAULT_DEPTH = 4  # Search depth when no other limit is given.
+MAX_DEPTH = 64
+MOVES_TO_GO = 30  # Number of moves the remaining clock time is divided between.
+CHECK_INTERVAL = 1024  # Number of nodes between time checks.
+
+# Frontier pruning constants, by remaining depth.
+FUTILITY_MARGINS = (0, 200, 500)  # Quiet moves are pruned if the evaluation plus the margin can't reach alpha.
+RAZOR_MARGINS = (0, 300, 550)  # Nodes this far below alpha go straight to the quiescence search.
+
+# Late move reduction constants.
+LMR_FULL_DEPTH_MOVES = 3  # Number of moves of a node searched to full depth.
+LMR_MIN_DEPTH = 3  # Remaining depth from which late moves are reduced.
+
+# Search window constants.
+ASPIRATION_WINDOW = 50  # Half width of the first aspiration window around the previous score.
+ASPIRATION_LIMIT = 800  # Half width beyond which a failed aspiration search gets the full window.
+
+# Move ordering constants.
+HISTORY_AGING = 3  # History scores are divided by 2 ** HISTORY_AGING between searches.
+
+# Quiescence search constants.
+QUIESCENCE_SEE_PRUNING = True  # Skip captures that lose material by static exchange evaluation.
+QUIESCENCE_DEPTH = None  # Maximum number of captures in a row, or None for no limit.
+DELTA_PRUNING = True  # Skip captures that can't raise alpha.
+DELTA_MARGIN = 200  # Positional gain allowed for on top of the captured piece's value.
+DELTA_PRUNING_PHASE = 6  # Game phase at and below which delta pruning is off.
+
+# Opening book constants.
+BOOK_FILE = 'book.bin'  # Opening book the client plays from, if the file exists.
+BOOK_PLIES = 20  # Number of plies of every game that go into a book.
+
+# Endgame tablebase constants.
+TABLEBASE_FILE = 'tablebase.bin'  # Endgame tablebase the client probes, if the file exists.
+TABLEBASE_ENDINGS = ('KQK', 'KRK', 'KPK', 'KBNK')  # Endings that go into a tablebase by default.
+TABLEBASE_WIN = 1  # Probe results for the side to move.
+TABLEBASE_DRAW = 0
+TABLEBASE_LOSS = -1
+
+# Parallel search constants.
+SEARCH_PROCESSES = 1  # Number of processes searching a move. More than one uses lazy SMP.
 
 # Piece tables.
 WHITE_PAWN_TABLE = (0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,  0,
@@ -175,3 +237,26 @@ BLACK_KING_END_TABLE = (-50,-30,-30,-30,-30,-30,-30,-50,  0,  0,  0,  0,  0,  0,
                         -30,-10, 20, 30, 30, 20,-10,-30,  0,  0,  0,  0,  0,  0,  0,  0,
                         -30,-20,-10,  0,  0,-10,-20,-30,  0,  0,  0,  0,  0,  0,  0,  0,
                         -50,-40,-30,-20,-20,-30,-40,-50,  0,  0,  0,  0,  0,  0,  0,  0)
+
+# Piece information by type.
+PIECE_VALUES = {PAWN: PAWN_VALUE, KNIGHT: KNIGHT_VALUE, BISHOP: BISHOP_VALUE, ROOK: ROOK_VALUE, QUEEN: QUEEN_VALUE,
+                KING: KING_VALUE}
+PIECE_NAMES = {PAWN: 'pawn', KNIGHT: 'knight', BISHOP: 'bishop', ROOK: 'rook', QUEEN: 'queen', KING: 'king'}
+
+# Piece tables by piece code. Kings have separate middle game and end game tables.
+PIECE_TABLES = {WHITE_PAWN: WHITE_PAWN_TABLE, WHITE_KNIGHT: WHITE_KNIGHT_TABLE, WHITE_BISHOP: WHITE_BISHOP_TABLE,
+                WHITE_ROOK: WHITE_ROOK_TABLE, WHITE_QUEEN: WHITE_QUEEN_TABLE, WHITE_KING: WHITE_KING_MIDDLE_TABLE,
+                BLACK_PAWN: BLACK_PAWN_TABLE, BLACK_KNIGHT: BLACK_KNIGHT_TABLE, BLACK_BISHOP: BLACK_BISHOP_TABLE,
+                BLACK_ROOK: BLACK_ROOK_TABLE, BLACK_QUEEN: BLACK_QUEEN_TABLE, BLACK_KING: BLACK_KING_MIDDLE_TABLE}
+END_GAME_TABLES = dict(PIECE_TABLES)
+END_GAME_TABLES[WHITE_KING] = WHITE_KING_END_TABLE
+END_GAME_TABLES[BLACK_KING] = BLACK_KING_END_TABLE
+
+# Game phase constants. The phase is the sum of the weights of the pieces on the board, TOTAL_PHASE at the start.
+PHASE_WEIGHTS = {PAWN: 0, KNIGHT: 1, BISHOP: 1, ROOK: 2, QUEEN: 4, KING: 0}
+TOTAL_PHASE = 24
+
+# FEN constants.
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+FEN_PIECES = {'p': PAWN, 'n': KNIGHT, 'b': BISHOP, 'r': ROOK, 'q': QUEEN, 'k': KING}
+PIECE_LETTERS = {PAWN: 'p', KNIGHT: 'n', BISHOP: 'b', ROOK: 'r', QUEEN: 'q', KING: 'k'}
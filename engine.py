@@ -1,59 +1,394 @@
 # C H E S S   E N G I N E .
 
 from constants import *
+import copy
+import math
+import random
 import time
+from operator import itemgetter
+
+# Zobrist keys. The generator is seeded so that position keys are the same in every run.
+zobrist_random = random.Random(0x88)
+ZOBRIST_PIECES = [[zobrist_random.getrandbits(64) for square in range(128)] for piece_code in range(16)]
+ZOBRIST_CASTLING = [zobrist_random.getrandbits(64) for i in range(4)]  # White short, white long, black short, black long.
+ZOBRIST_PASSANT = [zobrist_random.getrandbits(64) for square in range(128)]
+ZOBRIST_SIDE = zobrist_random.getrandbits(64)  # Black to move.
+ZOBRIST_PAWNS = [ZOBRIST_PIECES[piece_code] if piece_code & 7 == PAWN else [0] * 128 for piece_code in range(16)]
+
+# Evaluation terms by piece code and square: the piece value plus its piece table value, negative for black. The
+# board keeps their sums and the game phase up to date as pieces are put on and taken off squares.
+MIDDLE_GAME_SCORES = [[0] * 128 for piece_code in range(16)]
+END_GAME_SCORES = [[0] * 128 for piece_code in range(16)]
+PIECE_PHASES = [0] * 16
+for piece_code in PIECE_TABLES:
+    sign = 1 if piece_code < 8 else -1
+    piece_value = PIECE_VALUES[piece_code & 7]
+    for square in range(128):
+        MIDDLE_GAME_SCORES[piece_code][square] = sign * (piece_value + PIECE_TABLES[piece_code][square])
+        END_GAME_SCORES[piece_code][square] = sign * (piece_value + END_GAME_TABLES[piece_code][square])
+    PIECE_PHASES[piece_code] = PHASE_WEIGHTS[piece_code & 7]
+
+# Bitboards. Bit row * 8 + column stands for the 0x88 square row * 16 + column. The tables are indexed by 0x88
+# square.
+BIT_SQUARES = [row * 16 + column for row in range(8) for column in range(8)]
+SQUARE_MASKS = [0] * 128
+for bit, square in enumerate(BIT_SQUARES):
+    SQUARE_MASKS[square] = 1 << bit
+
+BISHOP_STEPS = (-17, -15, 15, 17)
+ROOK_STEPS = (-16, -1, 1, 16)
+KNIGHT_STEPS = (-33, -31, -18, -14, 14, 18, 31, 33)
+KING_STEPS = BISHOP_STEPS + ROOK_STEPS
+
+
+def stepMask(square, steps):
+    """ Returns the mask of the squares one step away from the square. """
+    mask = 0
+    for step in steps:
+        if not square & 0x88 and not (square + step) & 0x88:
+            mask |= SQUARE_MASKS[square + step]
+    return mask
+
+
+def rayMask(square, step):
+    """ Returns the mask of the squares from the square to the edge of the board, not including the square. """
+    mask = 0
+    if not square & 0x88:
+        square += step
+        while not square & 0x88:
+            mask |= SQUARE_MASKS[square]
+            square += step
+    return mask
+
+
+KNIGHT_ATTACKS = [stepMask(square, KNIGHT_STEPS) for square in range(128)]
+KING_ATTACKS = [stepMask(square, KING_STEPS) for square in range(128)]
+PAWN_ATTACKS = {WHITE: [stepMask(square, (-17, -15)) for square in range(128)],
+                BLACK: [stepMask(square, (15, 17)) for square in range(128)]}
+RAY_MASKS = dict((step, [rayMask(square, step) for square in range(128)]) for step in KING_STEPS)
+BISHOP_RAYS = [0] * 128  # Sliding attacks on an empty board.
+ROOK_RAYS = [0] * 128
+for square in range(128):
+    for step in BISHOP_STEPS:
+        BISHOP_RAYS[square] |= RAY_MASKS[step][square]
+    for step in ROOK_STEPS:
+        ROOK_RAYS[square] |= RAY_MASKS[step][square]
+
+# Pawn structure masks, indexed by bit. A pawn is passed if no enemy pawn is in its passed pawn mask: the squares
+# in front of it on its own and the adjacent files.
+FILE_MASKS = [sum(1 << (row * 8 + column) for row in range(8)) for column in range(8)]
+ADJACENT_FILE_MASKS = [(FILE_MASKS[column - 1] if column > 0 else 0) | (FILE_MASKS[column + 1] if column < 7 else 0)
+                       for column in range(8)]
+PASSED_PAWN_MASKS = {WHITE: [0] * 64, BLACK: [0] * 64}
+for bit in range(64):
+    files = FILE_MASKS[bit & 7] | ADJACENT_FILE_MASKS[bit & 7]
+    PASSED_PAWN_MASKS[WHITE][bit] = files & ((1 << (bit & ~7)) - 1)  # Rows above the pawn.
+    PASSED_PAWN_MASKS[BLACK][bit] = files & ~((1 << ((bit | 7) + 1)) - 1)  # Rows below the pawn.
+
+
+# 0x88 difference tables, indexed by target square - origin square + 119. The difference of two squares on the
+# board tells if they are on a line, and which one.
+ATTACK_MASKS = [0] * 239  # Bit 1 << piece code is set if the piece can attack along the difference.
+ATTACK_STEPS = [0] * 239  # The unit step from the origin square towards the target square, or 0.
+for step in KING_STEPS:
+    slider = BISHOP if step in BISHOP_STEPS else ROOK
+    for distance in range(1, 8):
+        index = step * distance + 119
+        ATTACK_STEPS[index] = step
+        piece_types = (slider, QUEEN, KING) if distance == 1 else (slider, QUEEN)
+        for piece_type in piece_types:
+            ATTACK_MASKS[index] |= 1 << piece_type | 1 << (piece_type + 8)
+for step in KNIGHT_STEPS:
+    ATTACK_MASKS[step + 119] |= 1 << KNIGHT | 1 << (KNIGHT + 8)
+for step in (-17, -15):
+    ATTACK_MASKS[step + 119] |= 1 << PAWN  # White pawns attack up the board, black pawns down.
+    ATTACK_MASKS[-step + 119] |= 1 << (PAWN + 8)
+
+
+def slidingAttacks(square, occupied, steps):
+    """ Returns the mask of the squares a sliding piece on the square attacks along the steps. Every ray stops at
+        the first occupied square.
+    """
+    attacks = 0
+    for step in steps:
+        ray = RAY_MASKS[step][square]
+        blockers = ray & occupied
+        if blockers:
+            # The nearest blocker is the lowest bit on rays going down the board, the highest going up.
+            if step > 0:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= RAY_MASKS[step][BIT_SQUARES[blocker]]
+        attacks |= ray
+    return attacks
+
+
+def pieceAttacks(piece_type, color, square, occupied):
+    """ Returns the mask of the squares a piece on the square attacks. """
+    if piece_type == PAWN:
+        return PAWN_ATTACKS[color][square]
+    elif piece_type == KNIGHT:
+        return KNIGHT_ATTACKS[square]
+    elif piece_type == KING:
+        return KING_ATTACKS[square]
+    elif piece_type == BISHOP:
+        return slidingAttacks(square, occupied, BISHOP_STEPS)
+    elif piece_type == ROOK:
+        return slidingAttacks(square, occupied, ROOK_STEPS)
+    else:
+        return slidingAttacks(square, occupied, KING_STEPS)
+
+
+# Moves are packed into integers: the target square (bits 0-6), the origin square (bits 7-13), the special move
+# (bits 14-16), the type of a promoted piece (bits 17-19), the code of the captured piece (bits 20-23) and the code
+# of the moved piece (bits 24-27). The low 14 bits are the move key, which identifies the move in a position.
+def packMove(origin_square, target_square, piece_code, captured_code=0, special=0, promotion=0):
+    """ Returns a move packed into an integer. """
+    return (target_square | origin_square << 7 | special << 14 | promotion << 17 | captured_code << 20 |
+            piece_code << 24)
+
+
+def moveTarget(move):
+    """ Returns the square the moved piece is put. """
+    return move & 0x7f
+
+
+def moveOrigin(move):
+    """ Returns the square the moved piece is taken from. """
+    return move >> 7 & 0x7f
+
+
+def moveSpecial(move):
+    """ Returns the special move (EN_PASSANT, SHORT_CASTLE, LONG_CASTLE or PROMOTION), or 0. """
+    return move >> 14 & 0x7
+
+
+def movePromotion(move):
+    """ Returns the type of the piece a pawn is promoted to, or 0. """
+    return move >> 17 & 0x7
+
+
+def moveCaptured(move):
+    """ Returns the code of the captured piece, or 0. """
+    return move >> 20 & 0xf
+
+
+def movePiece(move):
+    """ Returns the code of the moved piece. """
+    return move >> 24 & 0xf
+
+
+def moveKey(move):
+    """ Returns the move key, an integer made of the origin and target squares. """
+    return move & 0x3fff
+
+
+def moveNotation(move):
+    """ Returns the move in coordinate notation (e.g. 'e2e4' or 'e7e8q'). """
+    notation = squareToNotation(moveOrigin(move)) + squareToNotation(moveTarget(move))
+    if movePromotion(move):
+        notation += PIECE_LETTERS[movePromotion(move)]
+    return notation
+
+
+def squareToNotation(square):
+    """ Returns the chess notation (e.g. 'e4') of a board square. """
+    return 'abcdefgh'[square % 16] + str(8 - int(square / 16))
+
+
+def notationToSquare(notation):
+    """ Returns the board square of a chess notation (e.g. 'e4'). Raises ValueError if it isn't a square. """
+    if len(notation) != 2 or notation[0] not in 'abcdefgh' or notation[1] not in '12345678':
+        raise ValueError('invalid square: %r' % notation)
+    return (8 - int(notation[1])) * 16 + 'abcdefgh'.index(notation[0])
+
+
+def createPiece(piece_type, color, position):
+    """ Returns a new Piece object of the given type and color. """
+    code = piece_type if color == WHITE else piece_type + 8
+    graphics = 'graphics/%s_%s.png' % ('white' if color == WHITE else 'black', PIECE_NAMES[piece_type])
+    return Piece(piece_type, color, position, PIECE_VALUES[piece_type], PIECE_TABLES[code], graphics)
+
 
 class Board(object):
     
-    def __init__(self):
-        """ Creates a new board with all the pieces at their original positions.
-            Also initializes a variable that holds an en_passant square.
+    def __init__(self, white_type=HUMAN, black_type=COMPUTER, fen=START_FEN):
+        """ Creates a new board with its own players. The pieces are put in place from a FEN string, by default
+            the start position. Raises ValueError if the FEN string is invalid.
+        """
+        self.white_player = Player('white', WHITE, white_type)
+        self.black_player = Player('black', BLACK, black_type)
+        self.setFen(fen)
+
+    def setFen(self, fen):
+        """ Sets up the position from a FEN string: pieces, side to move, castling rights, en passant square and
+            move counters. Raises ValueError if the FEN string is invalid.
         """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError('invalid FEN: %r' % fen)
+
         self.board = []
         for square in range(128):
             self.board.append(EMPTY)
-
-        # Put all the black pieces in place. 
-        self.board[0], self.board[7] = black_rook1, black_rook2
-        self.board[1], self.board[6] = black_knight1, black_knight2
-        self.board[2], self.board[5] = black_bishop1, black_bishop2
-        self.board[3] = black_queen
-        self.board[4] = black_king
-        
-        self.board[16] = black_pawn1
-        self.board[17] = black_pawn2
-        self.board[18] = black_pawn3
-        self.board[19] = black_pawn4
-        self.board[20] = black_pawn5
-        self.board[21] = black_pawn6
-        self.board[22] = black_pawn7
-        self.board[23] = black_pawn8
-            
-        # Put all the white pieces in place.
-        self.board[112], self.board[119] = white_rook1, white_rook2
-        self.board[113], self.board[118] = white_knight1, white_knight2
-        self.board[114], self.board[117] = white_bishop1, white_bishop2
-        self.board[115] = white_queen
-        self.board[116] = white_king
-                                    
-        self.board[96] = white_pawn1
-        self.board[97] = white_pawn2
-        self.board[98] = white_pawn3
-        self.board[99] = white_pawn4
-        self.board[100] = white_pawn5
-        self.board[101] = white_pawn6
-        self.board[102] = white_pawn7
-        self.board[103] = white_pawn8
-
+        self.white_player.removeAllPieces()
+        self.black_player.removeAllPieces()
+        self.hash_key = 0
+        self.pawn_key = 0
+        self.middle_game_score = 0
+        self.end_game_score = 0
+        self.phase = 0
+        self.bitboards = [0] * 16  # One bitboard per piece code.
+        self.occupancy = {WHITE: 0, BLACK: 0}  # The squares of each player's pieces.
+        self.undo_stack = []  # What unmakeMove needs to take back every move made on the board, and the move.
+        self.key_history = []  # The position key before every move on the undo stack.
+        self.repetition_start = 0  # Index of the first key history entry that can be repeated.
+
+        # Piece placement, from the 8th rank down.
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError('invalid FEN: %r' % fen)
+        for row in range(8):
+            column = 0
+            for char in rows[row]:
+                if char.isdigit():
+                    column += int(char)
+                elif char.lower() in FEN_PIECES and column < 8:
+                    color = WHITE if char.isupper() else BLACK
+                    self.addPiece(createPiece(FEN_PIECES[char.lower()], color, row * 16 + column))
+                    column += 1
+                else:
+                    raise ValueError('invalid FEN: %r' % fen)
+            if column != 8:
+                raise ValueError('invalid FEN: %r' % fen)
+
+        if len(self.white_player.getPieceDict()[KING]) != 1 or len(self.black_player.getPieceDict()[KING]) != 1:
+            raise ValueError('invalid FEN, each side needs one king: %r' % fen)
+
+        # Side to move.
+        if fields[1] not in ('w', 'b'):
+            raise ValueError('invalid FEN: %r' % fen)
+        self.turn = self.white_player if fields[1] == 'w' else self.black_player
+
+        # Castling rights. A right is only kept if the king and the rook are still on their squares.
+        for player, king_square, letters in (self.white_player, 116, 'KQ'), (self.black_player, 4, 'kq'):
+            king = self.getPiece(king_square)
+            has_king = king and king.getType() == KING and king.getColor() == player.getColor()
+            short_rook = self.getPiece(king_square + 3)
+            long_rook = self.getPiece(king_square - 4)
+            player.changeShortCastle(bool(has_king and letters[0] in fields[2] and short_rook and
+                                          short_rook.getType() == ROOK and short_rook.getColor() == player.getColor()))
+            player.changeLongCastle(bool(has_king and letters[1] in fields[2] and long_rook and
+                                         long_rook.getType() == ROOK and long_rook.getColor() == player.getColor()))
+
+        # En passant square.
         self.passant_square = None
-        self.move_count = 0
+        if fields[3] != '-':
+            self.passant_square = notationToSquare(fields[3])
+
+        # Move counters.
+        self.move_count = int(fields[4]) if len(fields) > 4 else 0
+        self.move_number = int(fields[5]) if len(fields) > 5 else 1
+
+        self.hash_key = self.computeHashKey(self.turn)
+
+    def getFen(self):
+        """ Returns the FEN string of the current position. """
+        rows = []
+        for row in range(8):
+            text = ''
+            empty = 0
+            for column in range(8):
+                piece = self.getPiece(row * 16 + column)
+                if piece:
+                    if empty:
+                        text += str(empty)
+                        empty = 0
+                    letter = PIECE_LETTERS[piece.getType()]
+                    text += letter.upper() if piece.getColor() == WHITE else letter
+                else:
+                    empty += 1
+            if empty:
+                text += str(empty)
+            rows.append(text)
+
+        castling = ''
+        if self.white_player.getShortCastle():
+            castling += 'K'
+        if self.white_player.getLongCastle():
+            castling += 'Q'
+        if self.black_player.getShortCastle():
+            castling += 'k'
+        if self.black_player.getLongCastle():
+            castling += 'q'
+
+        passant = squareToNotation(self.passant_square) if self.passant_square is not None else '-'
+        side = 'w' if self.turn == self.white_player else 'b'
+
+        return '%s %s %s %s %d %d' % ('/'.join(rows), side, castling or '-', passant, self.move_count,
+                                      self.move_number)
+
+    def getSideToMove(self):
+        """ Returns the Player object whose turn it is. """
+        return self.turn
+
+    def copy(self):
+        """ Returns a copy of the board that shares no pieces or players with this one. The moves made so far can
+            be taken back on the copy too.
+        """
+        board = copy.copy(self)  # Copies the en passant square, move counters and position key.
+        board.white_player = self.white_player.copy()
+        board.black_player = self.black_player.copy()
+        board.turn = board.getPlayer(self.turn.getColor())
+        board.bitboards = list(self.bitboards)
+        board.occupancy = dict(self.occupancy)
+        board.key_history = list(self.key_history)
+        board.board = [EMPTY] * 128
+        new_pieces = {}
+        for square in range(128):
+            piece = self.board[square]
+            if piece:
+                new_piece = piece.copy()
+                new_pieces[piece] = new_piece
+                board.board[square] = new_piece
+                board.getPlayer(piece.getColor()).addPiece(new_piece)
+
+        # Captured and promoted pieces on the undo stack are copied once each.
+        board.undo_stack = []
+        for record in self.undo_stack:
+            for piece in record[:2]:
+                if piece and piece not in new_pieces:
+                    new_pieces[piece] = piece.copy()
+            board.undo_stack.append((new_pieces[record[0]], new_pieces.get(record[1], EMPTY)) + record[2:])
+        return board
+
+    def addPiece(self, piece):
+        """ Puts a new piece on the board and gives it to its player. """
+        self.setPiece(piece.getPosition(), piece)
+        self.getPlayer(piece.getColor()).addPiece(piece)
+
+    def getWhitePlayer(self):
+        """ Returns the white Player object. """
+        return self.white_player
+
+    def getBlackPlayer(self):
+        """ Returns the black Player object. """
+        return self.black_player
+
+    def getPlayer(self, color):
+        """ Returns the Player object of the given color. """
+        if color == WHITE:
+            return self.white_player
+        else:
+            return self.black_player
 
     def getOtherPlayer(self, player):
         """ Returns the other Player object. """
-        if player == white_player:
-            return black_player
+        if player == self.white_player:
+            return self.black_player
         else:
-            return white_player
+            return self.white_player
 
     def getState(self):
         """ Returns the current state of the board data structure. """
@@ -64,135 +399,308 @@ class Board(object):
         return self.board[square]
 
     def setPiece(self, square, piece):
-        """ Put a piece on the square or makes a square empty. """
+        """ Put a piece on the square or makes a square empty. Keeps the position and pawn keys, the bitboards,
+            the evaluation scores and the game phase up to date.
+        """
+        mask = SQUARE_MASKS[square]
+        old_piece = self.board[square]
+        if old_piece:
+            code = old_piece.getCode()
+            self.hash_key ^= ZOBRIST_PIECES[code][square]
+            self.pawn_key ^= ZOBRIST_PAWNS[code][square]
+            self.bitboards[code] ^= mask
+            self.occupancy[old_piece.getColor()] ^= mask
+            self.middle_game_score -= MIDDLE_GAME_SCORES[code][square]
+            self.end_game_score -= END_GAME_SCORES[code][square]
+            self.phase -= PIECE_PHASES[code]
+        if piece:
+            code = piece.getCode()
+            self.hash_key ^= ZOBRIST_PIECES[code][square]
+            self.pawn_key ^= ZOBRIST_PAWNS[code][square]
+            self.bitboards[code] ^= mask
+            self.occupancy[piece.getColor()] ^= mask
+            self.middle_game_score += MIDDLE_GAME_SCORES[code][square]
+            self.end_game_score += END_GAME_SCORES[code][square]
+            self.phase += PIECE_PHASES[code]
         self.board[square] = piece
 
+    def getMiddleGameScore(self):
+        """ Returns the material and piece table score of the position for white, with middle game tables. """
+        return self.middle_game_score
+
+    def getEndGameScore(self):
+        """ Returns the material and piece table score of the position for white, with end game tables. """
+        return self.end_game_score
+
+    def getPhase(self):
+        """ Returns the game phase, from TOTAL_PHASE with all the pieces on the board down to 0 with only kings and
+            pawns left. Promotions can take it above TOTAL_PHASE.
+        """
+        return self.phase
+
+    def getBitboard(self, piece_type, color):
+        """ Returns the bitboard of the player's pieces of the given type. """
+        return self.bitboards[piece_type if color == WHITE else piece_type + 8]
+
+    def getOccupancy(self, color):
+        """ Returns the bitboard of all the player's pieces. """
+        return self.occupancy[color]
+
+    def getHashKey(self):
+        """ Returns the 64-bit Zobrist key of the current position. """
+        return self.hash_key
+
+    def getPawnKey(self):
+        """ Returns the Zobrist key of the pawns on the board. It only changes with pawn moves, captures of pawns
+            and promotions.
+        """
+        return self.pawn_key
+
+    def computeHashKey(self, player):
+        """ Computes the Zobrist key of the current position from scratch, player being the side to move. """
+        hash_key = 0
+        for square in range(128):
+            piece = self.board[square]
+            if piece:
+                hash_key ^= ZOBRIST_PIECES[piece.getCode()][square]
+
+        hash_key ^= self.castlingKey(self.white_player) ^ self.castlingKey(self.black_player)
+        if self.passant_square is not None:
+            hash_key ^= ZOBRIST_PASSANT[self.passant_square]
+        if player.getColor() == BLACK:
+            hash_key ^= ZOBRIST_SIDE
+
+        return hash_key
+
+    def castlingKey(self, player):
+        """ Returns the Zobrist key of the player's castling rights. """
+        index = 0 if player.getColor() == WHITE else 2
+        key = 0
+        if player.getShortCastle():
+            key ^= ZOBRIST_CASTLING[index]
+        if player.getLongCastle():
+            key ^= ZOBRIST_CASTLING[index + 1]
+        return key
+
+    def passantKey(self):
+        """ Returns the Zobrist key of the en passant square (0 if there is none). """
+        if self.passant_square is None:
+            return 0
+        return ZOBRIST_PASSANT[self.passant_square]
+
     def getMoveCount(self):
         return self.move_count
 
+    def isRepetition(self):
+        """ Returns True if the current position occurred before since the last capture or pawn move. Positions
+            before a null move don't count.
+        """
+        keys = self.key_history
+        hash_key = self.hash_key
+
+        # Only every other position has the same side to move.
+        for index in range(len(keys) - 2, max(len(keys) - self.move_count, self.repetition_start) - 1, -2):
+            if keys[index] == hash_key:
+                return True
+        return False
+
+    def setKeyHistory(self, keys):
+        """ Sets the keys of the positions the game went through before the current one, oldest first, when the
+            board was set up from a FEN string. They are used to find repetitions.
+        """
+        self.key_history = list(keys)
+
+    def getKeyHistory(self):
+        """ Returns the keys of the positions before the current one, oldest first. """
+        return self.key_history
+
+    def takeBack(self):
+        """ Takes back the last move made on the board. Returns the move, or None if no move was made. """
+        if not self.undo_stack:
+            return None
+        move = self.undo_stack[-1][-1]
+        self.unmakeMove(move, self.getOtherPlayer(self.turn))
+        return move
+
+    def getMoveNumber(self):
+        """ Returns the full move number, which starts at 1 and grows after every black move. """
+        return self.move_number
+
+    def makeNullMove(self):
+        """ Passes the turn to the other player. Returns the (en passant square, repetition start) pair that
+            unmakeNullMove needs. A line through a null move isn't a real game, so positions before it can't be
+            repeated.
+        """
+        null_state = self.passant_square, self.repetition_start
+        self.key_history.append(self.hash_key)
+        self.repetition_start = len(self.key_history)
+        self.hash_key ^= self.passantKey() ^ ZOBRIST_SIDE
+        self.passant_square = None
+        self.turn = self.getOtherPlayer(self.turn)
+        return null_state
+
+    def unmakeNullMove(self, null_state):
+        """ Gives the turn back after a null move. Returns None. """
+        self.passant_square, self.repetition_start = null_state
+        self.key_history.pop()
+        self.hash_key ^= self.passantKey() ^ ZOBRIST_SIDE
+        self.turn = self.getOtherPlayer(self.turn)
+
     def isSquareUnderAttack(self, rules, square, player):
         """ Returns True if the square is under attack by a given player's piece. """
-        players_color = player.getColor()
-        other_players_color = self.getOtherPlayer(player).getColor()
-        
-        # Knight attacks.
-        for knight_move in (14, 18, -14, -18, 31, 33, -31, -33):
-            attack_square = square + knight_move
-            if not attack_square & 0x88:
-                piece = self.getPiece(attack_square)
-                if piece and piece.getType() == KNIGHT and piece.getColor() == players_color:
-                    return True
+        bitboards = self.bitboards
+        offset = 0 if player.getColor() == WHITE else 8
 
-        # Check for every other piece attacks.
-        for other_move in (-17, -16, -15, 1, 17, 16, 15, -1):
-            attack_square = square + other_move
-            if not attack_square & 0x88:
-                piece = self.getPiece(attack_square)
-                
-                if not piece or (piece and piece.getColor() != other_players_color):
-                    # King attacks.
-                    if piece and piece.getType() == KING and piece.getColor() == players_color:
-                        return True
-
-                    # Pawn attacks.
-                    elif piece and piece.getType() == PAWN:
-                        if players_color == WHITE and other_move in (17, 15):
-                            return True
-                        elif players_color == BLACK and other_move in (-17, -15):
-                            return True
-
-                    while True:
-                        if piece:
-                            # Queen attacks.
-                            if piece.getType() == QUEEN and piece.getColor() == players_color:
-                                return True
-
-                            # Bishop attacks.
-                            elif piece.getType() == BISHOP and other_move in (-17, -15, 17, 15):
-                                return True
-
-                            # Rook attacks.
-                            elif piece.getType() == ROOK and other_move in (-1, -16, 1, 16):
-                                return True
-
-                            else:
-                                break
-
-                        attack_square += other_move
-                        if not attack_square & 0x88:
-                            piece = self.getPiece(attack_square)
-                            if piece and piece.getColor() == other_players_color:
-                                break
-                        else:
-                            break
+        if KNIGHT_ATTACKS[square] & bitboards[offset + KNIGHT]:
+            return True
+        if KING_ATTACKS[square] & bitboards[offset + KING]:
+            return True
 
-        return False 
+        # A pawn attacks the square if a pawn of the other color on the square would attack it.
+        if PAWN_ATTACKS[-player.getColor()][square] & bitboards[offset + PAWN]:
+            return True
+
+        # Sliding pieces: the empty board rays tell if a piece lines up with the square. Only then the blockers are
+        # looked at.
+        diagonal = BISHOP_RAYS[square] & (bitboards[offset + BISHOP] | bitboards[offset + QUEEN])
+        straight = ROOK_RAYS[square] & (bitboards[offset + ROOK] | bitboards[offset + QUEEN])
+        if diagonal or straight:
+            occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+            if diagonal and slidingAttacks(square, occupied, BISHOP_STEPS) & diagonal:
+                return True
+            if straight and slidingAttacks(square, occupied, ROOK_STEPS) & straight:
+                return True
+
+        return False
+
+    def getAttackers(self, square, occupied):
+        """ Returns the bitboard of the pieces of both players that attack the square, with occupied as the
+            occupied squares. Sliding pieces behind a removed piece attack through its square.
+        """
+        bitboards = self.bitboards
+        attackers = KNIGHT_ATTACKS[square] & (bitboards[KNIGHT] | bitboards[KNIGHT + 8])
+        attackers |= KING_ATTACKS[square] & (bitboards[KING] | bitboards[KING + 8])
+        attackers |= PAWN_ATTACKS[BLACK][square] & bitboards[PAWN]
+        attackers |= PAWN_ATTACKS[WHITE][square] & bitboards[PAWN + 8]
+
+        diagonal = bitboards[BISHOP] | bitboards[QUEEN] | bitboards[BISHOP + 8] | bitboards[QUEEN + 8]
+        if BISHOP_RAYS[square] & diagonal:
+            attackers |= slidingAttacks(square, occupied, BISHOP_STEPS) & diagonal
+        straight = bitboards[ROOK] | bitboards[QUEEN] | bitboards[ROOK + 8] | bitboards[QUEEN + 8]
+        if ROOK_RAYS[square] & straight:
+            attackers |= slidingAttacks(square, occupied, ROOK_STEPS) & straight
+
+        return attackers & occupied
+
+    def staticExchange(self, move):
+        """ Returns the material the side making the capture wins (or loses, if negative) when both sides keep
+            capturing on the target square with their least valuable attacker and may stop at any time.
+        """
+        target_square = move & 0x7f
+        color = WHITE if move >> 24 & 0x8 == 0 else BLACK
+        bitboards = self.bitboards
+
+        occupied = (self.occupancy[WHITE] | self.occupancy[BLACK]) ^ SQUARE_MASKS[move >> 7 & 0x7f]
+        gains = [PIECE_VALUES[move >> 20 & 0x7]]
+        piece_value = PIECE_VALUES[move >> 24 & 0x7]  # Value of the piece standing on the target square.
+        if move >> 17 & 0x7:
+            gains[0] += PIECE_VALUES[move >> 17 & 0x7] - PAWN_VALUE
+            piece_value = PIECE_VALUES[move >> 17 & 0x7]
+
+        while True:
+            color = -color
+            attackers = self.getAttackers(target_square, occupied) & self.occupancy[color]
+            if not attackers:
+                break
+
+            # The least valuable attacker captures next.
+            offset = 0 if color == WHITE else 8
+            for piece_type in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+                pieces = attackers & bitboards[offset + piece_type]
+                if pieces:
+                    break
+
+            gains.append(piece_value - gains[-1])
+            piece_value = PIECE_VALUES[piece_type]
+            occupied ^= pieces & -pieces
+
+        # Either side can stand pat instead of capturing back.
+        while len(gains) > 1:
+            gain = gains.pop()
+            gains[-1] = min(gains[-1], -gain)
+
+        return gains[0]
 
     def getPassantSquare(self):
         return self.passant_square
 
     def generatePieceMoves(self, rules, piece, player):
-        """ Returns a list of Move objects representing legal moves the piece can make. """
+        """ Returns a list of the legal moves the piece can make. """
         valid_moves = []
         piece_pos = piece.getPosition()
         piece_type = piece.getType()
         piece_delta = piece.getDelta()
+        check_info = rules.getCheckInfo(self, player)
         
         for move_in_delta in piece_delta:
             target_square = piece_pos + move_in_delta
-            move = self.createMoveObject(piece_pos, target_square, player)
+            move = self.createMove(piece_pos, target_square, player)
 
             if piece_type & 4:
                 while not target_square & 0x88 and not self.getPiece(target_square):
                     if rules.isPseudoLegal(move, self, player):
-                        if rules.isLegal(move, self, player):
+                        if rules.isLegal(move, self, player, check_info):
                             valid_moves.append(move)
                     target_square += move_in_delta
-                    move = self.createMoveObject(piece_pos, target_square, player)
+                    move = self.createMove(piece_pos, target_square, player)
 
             if rules.isPseudoLegal(move, self, player):
-                if rules.isLegal(move, self, player):
+                if rules.isLegal(move, self, player, check_info):
                     valid_moves.append(move)
 
         if piece_type == KING:
             if player.getShortCastle():
-                move = self.createMoveObject(piece_pos, piece_pos + 2, player)
+                move = self.createMove(piece_pos, piece_pos + 2, player)
                 if rules.isPseudoLegal(move, self, player):
-                    if rules.isLegal(move, self, player):
+                    if rules.isLegal(move, self, player, check_info):
                         valid_moves.append(move)
 
             if player.getLongCastle():
-                move = self.createMoveObject(piece_pos, piece_pos - 2, player)
+                move = self.createMove(piece_pos, piece_pos - 2, player)
                 if rules.isPseudoLegal(move, self, player):
-                    if rules.isLegal(move, self, player):
+                    if rules.isLegal(move, self, player, check_info):
                         valid_moves.append(move)
 
         return valid_moves
 
-    def generateCaptures(self, rules, player):
-        """ Returns a list of Move objects that are pseudo-legal captrues. """
+    def generateCaptures(self, rules, player, check_info=None):
+        """ Returns a list of the pseudo-legal captures. If the check information from Rules.getCheckInfo is
+            given, only the legal captures are returned.
+        """
         captures = []
         piece_dict = player.getPieceDict()
+        color = player.getColor()
+        enemies = self.occupancy[-color]
+        occupied = self.occupancy[color] | enemies
 
         for piece_type in piece_dict:
             for piece in piece_dict[piece_type]:
                 piece_pos = piece.getPosition()
-                for move_in_delta in piece.getDelta():
-                    target_square = piece_pos + move_in_delta
+                targets = pieceAttacks(piece_type, color, piece_pos, occupied) & enemies
+                while targets:
+                    target = targets & -targets
+                    targets ^= target
+                    captures.append(self.createMove(piece_pos, BIT_SQUARES[target.bit_length() - 1], player))
 
-                    if piece_type & 4:  # Sliding piece.
-                        while not target_square & 0x88 and not self.getPiece(target_square):
-                            target_square += move_in_delta
-
-                    move = self.createMoveObject(piece_pos, target_square, player)
-                    if rules.isPseudoLegal(move, self, player) and self.getPiece(target_square):
-                        move = self.createMoveObject(piece_pos, target_square, player)
-                        captures.append(move)
+        if check_info is not None:
+            captures = [move for move in captures if rules.isLegal(move, self, player, check_info)]
 
         return captures
 
-    def generateNonCaptures(self, rules, player):
-        """ Returns a list of Move objects that are pseudo-legal non-captures. """
+    def generateNonCaptures(self, rules, player, check_info=None):
+        """ Returns a list of the pseudo-legal non-captures. If the check information from Rules.getCheckInfo is
+            given, only the legal non-captures are returned.
+        """
         non_captures = []
         piece_dict = player.getPieceDict()
 
@@ -201,40 +709,66 @@ class Board(object):
                 piece_pos = piece.getPosition()
                 for move_in_delta in piece.getDelta():
                     target_square = piece_pos + move_in_delta
-                    move = self.createMoveObject(piece_pos, target_square, player)
+                    move = self.createMove(piece_pos, target_square, player)
 
                     if piece_type & 4:  # Sliding piece.
                         while not target_square & 0x88 and not self.getPiece(target_square):
                             if rules.isPseudoLegal(move, self, player):
                                 non_captures.append(move)
                             target_square += move_in_delta
-                            move = self.createMoveObject(piece_pos, target_square, player)
+                            move = self.createMove(piece_pos, target_square, player)
 
                     if rules.isPseudoLegal(move, self, player) and not self.getPiece(target_square):
                         non_captures.append(move)
 
         if player.getShortCastle():
             kings_pos = player.getPieceDict()[KING][0].getPosition()
-            move = self.createMoveObject(kings_pos, kings_pos + 2, player)
+            move = self.createMove(kings_pos, kings_pos + 2, player)
             if rules.isPseudoLegal(move, self, player):
                 non_captures.append(move)
 
         if player.getLongCastle():
             kings_pos = player.getPieceDict()[KING][0].getPosition()
-            move = self.createMoveObject(kings_pos, kings_pos - 2, player)
+            move = self.createMove(kings_pos, kings_pos - 2, player)
             if rules.isPseudoLegal(move, self, player):
                 non_captures.append(move)
 
+        if check_info is not None:
+            non_captures = [move for move in non_captures if rules.isLegal(move, self, player, check_info)]
+
         return non_captures
                     
     def makeMove(self, move, player):
-        """ Makes a move on the board and changes Piece object. Returns None. """
-        moved_piece = move.getPiece()
-        captured_piece = move.getCapturedPiece()
-        special_move = move.getSpecialMove()
+        """ Makes a move on the board and changes Piece object. What unmakeMove needs is pushed on the undo stack.
+            Returns None.
+        """
+        origin_square = move >> 7 & 0x7f
+        target_square = move & 0x7f
+        special_move = move >> 14 & 0x7
+        moved_piece = self.board[origin_square]
+        other_player = self.getOtherPlayer(player)
+
+        if special_move == EN_PASSANT:
+            if player.getColor() == WHITE:
+                captured_piece = self.board[target_square + 16]
+            else:
+                captured_piece = self.board[target_square - 16]
+        else:
+            captured_piece = self.board[target_square]
+
+        self.undo_stack.append((moved_piece, captured_piece, self.passant_square, self.move_count,
+                                player.getShortCastle(), player.getLongCastle(),
+                                other_player.getShortCastle(), other_player.getLongCastle(), move))
+        self.key_history.append(self.hash_key)
+
+        # Take the old castling rights and en passant square out of the key and switch sides.
+        self.hash_key ^= self.castlingKey(player) ^ self.castlingKey(other_player) ^ self.passantKey() ^ ZOBRIST_SIDE
         self.passant_square = None
+        self.turn = other_player
 
         self.move_count += 1
+        if player.getColor() == BLACK:
+            self.move_number += 1
 
         # CASTLING.
         if moved_piece.getType() == KING:
@@ -244,8 +778,8 @@ class Board(object):
 
             if special_move == SHORT_CASTLE:
                 # Move rook when short castling.
-                castling_rook = self.getPiece(move.getTargetSquare() + 1)
-                rook_target = move.getTargetSquare() - 1
+                castling_rook = self.getPiece(target_square + 1)
+                rook_target = target_square - 1
                 
                 self.setPiece(rook_target, castling_rook)
                 self.setPiece(castling_rook.getPosition(), EMPTY)
@@ -254,8 +788,8 @@ class Board(object):
 
             elif special_move == LONG_CASTLE:
                  # Move rook when long castling.
-                castling_rook = self.getPiece(move.getTargetSquare() - 2)
-                rook_target = move.getTargetSquare() + 1
+                castling_rook = self.getPiece(target_square - 2)
+                rook_target = target_square + 1
                 
                 self.setPiece(rook_target, castling_rook)
                 self.setPiece(castling_rook.getPosition(), EMPTY)
@@ -266,83 +800,96 @@ class Board(object):
             # Rook move set's castling flag False on that side.
             if player.getColor() == WHITE:
                 # White player.
-                if moved_piece.getPosition() == 119:
+                if origin_square == 119:
                     player.changeShortCastle(False)
-                elif moved_piece.getPosition() == 112:
+                elif origin_square == 112:
                     player.changeLongCastle(False)
 
             else:
                 # Black player.
-                if moved_piece.getPosition() == 7:
+                if origin_square == 7:
                     player.changeShortCastle(False)
-                elif moved_piece.getPosition() == 0:
+                elif origin_square == 0:
                     player.changeLongCastle(False)
 
         # EN PASSANT.
         if special_move == EN_PASSANT:
-            if player.getColor() == WHITE:
-                self.setPiece(move.getTargetSquare() + 16, EMPTY)
-            else:
-                self.setPiece(move.getTargetSquare() - 16, EMPTY)
+            self.setPiece(captured_piece.getPosition(), EMPTY)
 
         # Get en passant square if pawn moved 2 squares at the beginning.
         if moved_piece.getType() == PAWN:
             self.move_count = 0
-            if player.getColor() == WHITE and int(moved_piece.getPosition() / 16) == 6 and \
-               move.getOriginSquare() - move.getTargetSquare() == 32:
-                self.passant_square = move.getTargetSquare() + 16
-            elif player.getColor() == BLACK and int(moved_piece.getPosition() / 16) == 1 and \
-                 move.getTargetSquare() - move.getOriginSquare() == 32:
-                self.passant_square = move.getTargetSquare() - 16
-                
-                          
+            if player.getColor() == WHITE and origin_square - target_square == 32:
+                self.passant_square = target_square + 16
+            elif player.getColor() == BLACK and target_square - origin_square == 32:
+                self.passant_square = target_square - 16
+
         # PROMOTION.
         if special_move == PROMOTION:
             # Get a new piece object.
-            if player.getColor() == WHITE:
-                new_piece = Piece(QUEEN, WHITE, move.getTargetSquare(), QUEEN_VALUE, WHITE_QUEEN_TABLE, 'graphics/white_queen.png')
-            else:
-                new_piece = Piece(QUEEN, BLACK, move.getTargetSquare(), QUEEN_VALUE, BLACK_QUEEN_TABLE, 'graphics/black_queen.png')
-            self.setPiece(new_piece.getPosition(), new_piece)
-            self.setPiece(moved_piece.getPosition(), EMPTY)
+            new_piece = createPiece(move >> 17 & 0x7, player.getColor(), target_square)
+            self.setPiece(target_square, new_piece)
+            self.setPiece(origin_square, EMPTY)
             player.addPiece(new_piece)
             player.removePiece(moved_piece)
             
         else:
-            self.setPiece(move.getTargetSquare(), moved_piece)  # Set moved piece on target square.
-            self.setPiece(moved_piece.getPosition(), EMPTY)  # Make the origin square empty.
-            moved_piece.changePosition(move.getTargetSquare())  # Change piece object's position.
+            self.setPiece(target_square, moved_piece)  # Set moved piece on target square.
+            self.setPiece(origin_square, EMPTY)  # Make the origin square empty.
+            moved_piece.changePosition(target_square)  # Change piece object's position.
 
         if captured_piece:  # Remove captured piece from other player's piece dict.
-            self.getOtherPlayer(player).removePiece(captured_piece)
+            other_player.removePiece(captured_piece)
             self.move_count = 0
 
+            # Capturing a rook on its original square takes away the other player's castling right on that side.
+            # Only the corners on the other player's own back rank count (h8/a8 for black, h1/a1 for white).
+            if captured_piece.getType() == ROOK:
+                back_rank = 0 if other_player.getColor() == BLACK else 112
+                if captured_piece.getPosition() == back_rank + 7:
+                    other_player.changeShortCastle(False)
+                elif captured_piece.getPosition() == back_rank:
+                    other_player.changeLongCastle(False)
+
+        # Put the new castling rights and en passant square into the key.
+        self.hash_key ^= self.castlingKey(player) ^ self.castlingKey(other_player) ^ self.passantKey()
+
     def unmakeMove(self, move, player):
-        """ Unmakes a move on the board. Returns None. """
-        moved_piece = move.getPiece()
-        captured_piece = move.getCapturedPiece()
-        special_move = move.getSpecialMove()
+        """ Unmakes the last move made on the board. Returns None. """
+        origin_square = move >> 7 & 0x7f
+        target_square = move & 0x7f
+        special_move = move >> 14 & 0x7
+        other_player = self.getOtherPlayer(player)
 
         # Set move count, castling and en passant count back.
-        prev_pos = move.getPreviousPosition()
-        self.passant_square = prev_pos[0]
-        player.changeShortCastle(prev_pos[1])
-        player.changeLongCastle(prev_pos[2])
-        self.move_count = prev_pos[3]
+        (moved_piece, captured_piece, passant_square, move_count, short_castle, long_castle, other_short_castle,
+         other_long_castle) = self.undo_stack.pop()[:8]
+        self.key_history.pop()
+        self.hash_key ^= self.castlingKey(player) ^ self.castlingKey(other_player) ^ self.passantKey() ^ ZOBRIST_SIDE
+        self.passant_square = passant_square
+        player.changeShortCastle(short_castle)
+        player.changeLongCastle(long_castle)
+        self.move_count = move_count
+        other_player.changeShortCastle(other_short_castle)
+        other_player.changeLongCastle(other_long_castle)
+        self.hash_key ^= self.castlingKey(player) ^ self.castlingKey(other_player) ^ self.passantKey()
+        self.turn = player
+        if player.getColor() == BLACK:
+            self.move_number -= 1
         
         if special_move == PROMOTION:
-            new_piece = self.getPiece(move.getTargetSquare())
+            new_piece = self.getPiece(target_square)
             player.removePiece(new_piece)  # Remove the new piece from the player's piece dictionary.
             player.addPiece(moved_piece)  # Put promoted piece back to player's piece dict.
 
         elif special_move == EN_PASSANT:
             self.setPiece(captured_piece.getPosition(), captured_piece)
-            self.setPiece(move.getTargetSquare(), EMPTY) 
+            self.setPiece(target_square, EMPTY) 
 
         elif special_move == SHORT_CASTLE:
             # Move rook back when short castling.
-            castling_rook = self.getPiece(move.getTargetSquare() - 1)
-            rook_target = move.getTargetSquare() + 1
+            castling_rook = self.getPiece(target_square - 1)
+            rook_target = target_square + 1
             
             self.setPiece(rook_target, castling_rook)
             self.setPiece(castling_rook.getPosition(), EMPTY)
@@ -351,8 +898,8 @@ class Board(object):
             
         elif special_move == LONG_CASTLE:
             # Move rook back when long castling.
-            castling_rook = self.getPiece(move.getTargetSquare() + 1)
-            rook_target = move.getTargetSquare() - 2
+            castling_rook = self.getPiece(target_square + 1)
+            rook_target = target_square - 2
 
             self.setPiece(rook_target, castling_rook)
             self.setPiece(castling_rook.getPosition(), EMPTY)
@@ -360,42 +907,101 @@ class Board(object):
             castling_rook.changePosition(rook_target)  # Change's Piece object's position (rook). 
             
         if special_move != EN_PASSANT:
-            self.setPiece(move.getTargetSquare(), captured_piece)  # Put captured piece (or empty square) back to it's position.
-        self.setPiece(move.getOriginSquare(), moved_piece)  # Put moved piece back to it's original position.
-        moved_piece.changePosition(move.getOriginSquare())  # Change piece object's position.
+            self.setPiece(target_square, captured_piece)  # Put captured piece (or empty square) back to it's position.
+        self.setPiece(origin_square, moved_piece)  # Put moved piece back to it's original position.
+        moved_piece.changePosition(origin_square)  # Change piece object's position.
 
         if captured_piece:  # Add captured piece to other player's piece dict.
-            self.getOtherPlayer(player).addPiece(captured_piece)
+            other_player.addPiece(captured_piece)
 
-    def createMoveObject(self, origin_square, target_square, player):
-        """ Create a move object. """
-        moved_piece = self.getPiece(origin_square)
+    def parseMove(self, rules, notation, player):
+        """ Returns the legal move for a move in coordinate notation (e.g. 'e2e4'), or None. """
         try:
-            captured_piece = self.getPiece(target_square)  # or empty square.
-        except:
-            captured_piece = None
-        special = None
-        prev_pos = [self.passant_square, player.getShortCastle(), player.getLongCastle(), self.move_count]
-        
+            origin_square = notationToSquare(notation[:2])
+            target_square = notationToSquare(notation[2:4])
+        except ValueError:
+            return None
+
+        move = self.createMove(origin_square, target_square, player)
+        if rules.isPseudoLegal(move, self, player) and rules.isLegal(move, self, player):
+            return move
+        return None
+
+    def getSan(self, rules, move, player):
+        """ Returns a legal move in standard algebraic notation (e.g. 'Nbd7' or 'exd5'), without check marks. """
+        special_move = moveSpecial(move)
+        if special_move == SHORT_CASTLE:
+            return 'O-O'
+        elif special_move == LONG_CASTLE:
+            return 'O-O-O'
+
+        piece = self.getPiece(moveOrigin(move))
+        origin = squareToNotation(moveOrigin(move))
+        target = squareToNotation(moveTarget(move))
+        capture = 'x' if moveCaptured(move) else ''
+
+        if piece.getType() == PAWN:
+            san = origin[0] + capture + target if capture else target
+            if special_move == PROMOTION:
+                san += '=' + PIECE_LETTERS[movePromotion(move)].upper()
+            return san
+
+        # Find other pieces of the same type that can go to the same square.
+        same_file = same_rank = ambiguous = False
+        for other_piece in player.getPieceDict()[piece.getType()]:
+            if other_piece == piece:
+                continue
+            other_move = self.createMove(other_piece.getPosition(), moveTarget(move), player)
+            if rules.isPseudoLegal(other_move, self, player) and rules.isLegal(other_move, self, player):
+                ambiguous = True
+                other_origin = squareToNotation(other_piece.getPosition())
+                same_file = same_file or other_origin[0] == origin[0]
+                same_rank = same_rank or other_origin[1] == origin[1]
+
+        if not ambiguous:
+            disambiguation = ''
+        elif not same_file:
+            disambiguation = origin[0]
+        elif not same_rank:
+            disambiguation = origin[1]
+        else:
+            disambiguation = origin
+
+        return PIECE_LETTERS[piece.getType()].upper() + disambiguation + capture + target
+
+    def createMove(self, origin_square, target_square, player):
+        """ Returns the move of the piece on the origin square to the target square, packed into an integer. The
+            move isn't checked. Returns EMPTY if the origin square is empty or a square is off the board.
+        """
+        if origin_square & 0x88 or target_square & 0x88:
+            return EMPTY
+
+        moved_piece = self.getPiece(origin_square)
+
         # If origin square is empty, return EMPTY. 
         if moved_piece == EMPTY:
             return EMPTY
 
-        elif moved_piece.getType() == PAWN:
+        captured_piece = self.getPiece(target_square)  # or empty square.
+        special = 0
+        promotion = 0
+
+        if moved_piece.getType() == PAWN:
             # Pawn promotion.
-            if (moved_piece.getColor() == WHITE and int(target_square / 16) == 0 and origin_square / 16 == 1) or \
-               (moved_piece.getColor() == BLACK and int(target_square / 16) == 7) and origin_square / 16 == 6:
+            if (moved_piece.getColor() == WHITE and target_square >> 4 == 0 and origin_square >> 4 == 1) or \
+               (moved_piece.getColor() == BLACK and target_square >> 4 == 7 and origin_square >> 4 == 6):
                     special = PROMOTION
+                    promotion = QUEEN
 
             # En passant.
             if (abs(target_square - origin_square) == 15 or abs(target_square - origin_square) == 17) \
                and not captured_piece:
                 if moved_piece.getColor() == WHITE:
-                    if int(target_square / 16) == 2:
+                    if target_square >> 4 == 2:
                         special = EN_PASSANT
                         captured_piece = self.getPiece(target_square + 16)
                 else:
-                    if int(target_square / 16) == 5:
+                    if target_square >> 4 == 5:
                         special = EN_PASSANT
                         captured_piece = self.getPiece(target_square - 16)
             
@@ -408,15 +1014,19 @@ class Board(object):
                 else:
                     special = LONG_CASTLE
 
-        return Move(moved_piece, origin_square, target_square, captured_piece, special, prev_pos)
+        captured_code = captured_piece.getCode() if captured_piece else 0
+        return packMove(origin_square, target_square, moved_piece.getCode(), captured_code, special, promotion)
 
 
 class Piece(object):
 
+    __slots__ = ('type', 'color', 'code', 'position', 'value', 'piece_table', 'graphics', 'image')
+
     def __init__(self, piece_type, color, position, value, piece_table, graphics):
         """ Set up piece information variables. """
         self.type = piece_type
         self.color = color
+        self.code = piece_type if color == WHITE else piece_type + 8  # E.g. WHITE_PAWN or BLACK_QUEEN.
         self.position = position
         self.value = value
         self.piece_table = piece_table
@@ -430,6 +1040,10 @@ class Piece(object):
         """ Returns the color of the piece. """
         return self.color
 
+    def getCode(self):
+        """ Returns the piece's code, which combines its type and color. """
+        return self.code
+
     def getPosition(self):
         """ Returns the position of the piece. """
         return self.position
@@ -442,14 +1056,21 @@ class Piece(object):
         """ Changes the position of the piece. """
         self.position = new_position
 
-    def insertNewPieceTable(self, new_table):
-        """ Replaces the piece's old piece-square table with a new one. """
-        self.piece_table = new_table 
-
     def getPieceTableValue(self):
         """ Returns the piece's square table value based on the position of the piece. """
         return self.piece_table[self.position] 
 
+    def copy(self):
+        """ Returns a copy of the piece. The loaded image is shared. """
+        piece = Piece(self.type, self.color, self.position, self.value, self.piece_table, self.graphics)
+        if hasattr(self, 'image'):
+            piece.image = self.image
+        return piece
+
+    def getGraphicsPath(self):
+        """ Returns the path of the piece's image file. """
+        return self.graphics
+
     def loadImage(self, image):
         self.image = image
 
@@ -475,52 +1096,11 @@ class Piece(object):
         return delta
             
 
-class Move(object):
-    
-    def __init__(self, piece, origin_square, target_square, capture, special, prev_pos):
-        """ Set up move infromation variables. """
-        self.piece = piece
-        self.origin_square = origin_square
-        self.target_square = target_square
-        self.captured_piece = capture
-        self.special = special
-        self.prev_pos = prev_pos
-                    
-    def getPiece(self):
-        """ Returns the piece object that is moved. """
-        return self.piece
-
-    def getOriginSquare(self):
-        """ Returns the square the moved piece is taken from. """
-        return self.origin_square
-
-    def getTargetSquare(self):
-        """ Returns the square the moved piece is put. """
-        return self.target_square
-
-    def getCapturedPiece(self):
-        """ Returns the captured piece. """
-        return self.captured_piece
-
-    def getSpecialMove(self):
-        """ If a move is 'special', returns the distinctive value. Otherwise None. """
-        return self.special
-
-    def getPreviousPosition(self):
-        """ Returns a list about the previous position's information. """
-        return self.prev_pos
-
-    def __eq__(self, other):
-        """ Overrides the normal __eg__ method. """
-        return (self.origin_square == other.origin_square) and \
-               (self.target_square == other.target_square)
-    
-
 class Player(object):
 
     def __init__(self, name, color, player_type):
-        """ Initializes some variables and sets up the piece dictionary which contains all the player's piece objects
-            still on the board.
+        """ Initializes some variables and sets up the piece dictionary which will contain all the player's piece
+            objects still on the board.
         """
         self.name = name
         self.color = color
@@ -528,24 +1108,15 @@ class Player(object):
         self.long_castle = True
         self.short_castle = True
 
-        # Set up the piece dictionary.
-        if self.color == WHITE:
-            self.piece_dict = {PAWN: [white_pawn1, white_pawn2, white_pawn3, white_pawn4,
-                                      white_pawn5, white_pawn6, white_pawn7, white_pawn8],
-                               KNIGHT: [white_knight1, white_knight2],
-                               BISHOP: [white_bishop1, white_bishop2],
-                               ROOK: [white_rook1, white_rook2],
-                               QUEEN: [white_queen],
-                               KING: [white_king]}
+        # Set up the piece dictionary. Board.addPiece fills it.
+        self.piece_dict = {PAWN: [], KNIGHT: [], BISHOP: [], ROOK: [], QUEEN: [], KING: []}
 
-        else:
-            self.piece_dict = {PAWN: [black_pawn1, black_pawn2, black_pawn3, black_pawn4,
-                                      black_pawn5, black_pawn6, black_pawn7, black_pawn8],
-                               KNIGHT: [black_knight1, black_knight2],
-                               BISHOP: [black_bishop1, black_bishop2],
-                               ROOK: [black_rook1, black_rook2],
-                               QUEEN: [black_queen],
-                               KING: [black_king]}
+    def copy(self):
+        """ Returns a copy of the player with the same castling rights and an empty piece dictionary. """
+        player = Player(self.name, self.color, self.type)
+        player.long_castle = self.long_castle
+        player.short_castle = self.short_castle
+        return player
 
     def getName(self):
         """ Returns player's name. """
@@ -587,6 +1158,11 @@ class Player(object):
                 del self.piece_dict[piece_type][i]
                 break
 
+    def removeAllPieces(self):
+        """ Empties the piece dictionary. """
+        for piece_type in self.piece_dict:
+            self.piece_dict[piece_type] = []
+
     def addPiece(self, piece):
         """ Adds a piece to the piece dictionary. """
         self.piece_dict[piece.getType()].append(piece)
@@ -596,17 +1172,13 @@ class Rules(object):
 
     def isPathClear(self, origin_square, target_square, step, board):
         """ Returns True if the horizontal, vertical or diagonal path between two squares is empty. """
-        # The base case, where origin square and target square are only one square apart.
-        if target_square - origin_square == step:
-            return True
-
-        # Change the origin square one square closer to target square.
-        origin_square += step
-        
-        if board.getPiece(origin_square):
-            return False
+        square = origin_square + step
+        while square != target_square:
+            if board.getPiece(square):
+                return False
+            square += step
 
-        return self.isPathClear(origin_square, target_square, step, board)
+        return True
 
     def isPseudoLegal(self, move, board, player):
         """ Returns True if a given move is pseudo legal. """
@@ -615,141 +1187,234 @@ class Rules(object):
         if not move:
             return False
 
-        origin_square = move.getOriginSquare()
-        target_square = move.getTargetSquare()
+        origin_square = move >> 7 & 0x7f
+        target_square = move & 0x7f
 
         # Check if target square is inside the board.
         if target_square & 0x88:
             return False
         
-        origin_piece = move.getPiece()
-        captured_piece = move.getCapturedPiece()
+        piece_code = move >> 24 & 0xf
+        piece_type = piece_code & 0x7
+        captured_piece = move >> 20 & 0xf  # The code of the captured piece.
+        own_pieces = 0 if player.getColor() == WHITE else 8
 
         # Check if trying to move to the same square.
         if origin_square == target_square:
             return False
 
         # Check if target square is occupied by a piece with the same color.
-        if captured_piece and player.getColor() == captured_piece.getColor():
+        if captured_piece and captured_piece & 8 == own_pieces:
             return False
 
         # Check if trying to move enemy's piece.
-        if origin_piece.getColor() != player.getColor():
+        if piece_code & 8 != own_pieces:
             return False 
 
         diff = target_square - origin_square
+        index = diff + 119
 
         # Pawn.
-        if origin_piece.getType() == PAWN:
-            # Move not in pawn's move delta.
-            if diff not in origin_piece.getDelta():
-                return False
+        if piece_type == PAWN:
+            forward = -16 if own_pieces == 0 else 16
 
             # Can't move directly ahead if pieces are blocking.
-            elif diff in origin_piece.getDelta()[:2] and captured_piece:
-                return False
+            if diff == forward:
+                return not captured_piece
 
-            # Can't move 2 squares if not at the starting position.
-            elif diff == origin_piece.getDelta()[1] and (int(origin_square / 16) != 1 and int(origin_square / 16) != 6):
-                return False
- 
-            # Can't move 2 squares ahead if piece is blocking.
-            elif diff == origin_piece.getDelta()[1] and board.getPiece(origin_square + origin_piece.getDelta()[0]):
-                return False
+            # Can move 2 squares only from the starting position and if both squares are empty.
+            elif diff == 2 * forward:
+                return not captured_piece and origin_square >> 4 == (6 if own_pieces == 0 else 1) and \
+                       not board.getPiece(origin_square + forward)
 
-            # En passant.
-            elif move.getSpecialMove() == EN_PASSANT and target_square != board.getPassantSquare():
-                return False 
-
-            # Can't move diagonally if there are no enemy pieces.
-            elif diff in origin_piece.getDelta()[2:] and not captured_piece:
-                return False
-
-        # Knight.
-        elif origin_piece.getType() == KNIGHT:
-            if diff not in origin_piece.getDelta():
-                return False
-
-        # Bishop.
-        elif origin_piece.getType() == BISHOP:
-            if diff % 17 and diff % 15:
-                return False
-
-        # Rook.
-        elif origin_piece.getType() == ROOK:
-            if diff % 16 and abs(diff) > 8:
-                return False
+            # Can move diagonally only to capture, en passant only on the en passant square.
+            elif ATTACK_MASKS[index] & 1 << piece_code:
+                if move >> 14 & 0x7 == EN_PASSANT:
+                    return target_square == board.getPassantSquare()
+                return bool(captured_piece)
 
-        # Queen.
-        elif origin_piece.getType() == QUEEN:
-            if (diff % 17 and diff % 15) and (diff % 16 and abs(diff) > 8):
-                return False
+            return False
 
-        # King.
-        elif origin_piece.getType() == KING:
+        # Castling.
+        if piece_type == KING:
             # Short castling. 
-            if move.getSpecialMove() == SHORT_CASTLE:
+            if move >> 14 & 0x7 == SHORT_CASTLE:
                 if player.getShortCastle() and \
                 not board.getPiece(origin_square + 1) and \
                 not board.getPiece(origin_square + 2):
                     return True
 
             # Long castling.
-            elif move.getSpecialMove() == LONG_CASTLE:
+            elif move >> 14 & 0x7 == LONG_CASTLE:
                 if player.getLongCastle() and \
                 not board.getPiece(origin_square - 1) and \
                 not board.getPiece(origin_square - 2) and \
                 not board.getPiece(origin_square - 3):
                     return True
 
-            if diff not in origin_piece.getDelta():
-                return False
+        # Knight, bishop, rook, queen and king: look up if the piece can move along the difference.
+        if not ATTACK_MASKS[index] & 1 << piece_code:
+            return False
             
         # See if a path between origin and target square is clear for sliding pieces. 
-        if origin_piece.getType() & 4:
-            if diff % 17 == 0:
-                step = 17
-            elif diff % 16 == 0:
-                step = 16
-            elif diff % 15 == 0:
-                step = 15
-            else:
-                step = 1
-
-            if diff < 0:
-                step *= -1
-
-            if not self.isPathClear(origin_square, target_square, step, board):
+        if piece_type & 4:
+            if not self.isPathClear(origin_square, target_square, ATTACK_STEPS[index], board):
                 return False
 
         return True  # If all the other tests were false.
     
-    def isLegal(self, move, board, player):
-        """ Returns True if the player's move is legal. """
-        if move.getSpecialMove() == SHORT_CASTLE:
-            square = move.getOriginSquare()
-            while square < (move.getTargetSquare() + 1):
+    def getCheckInfo(self, board, player):
+        """ Returns a (king square, checkers, pins) tuple for the player. checkers is a list of the squares of the
+            other player's pieces that give check. pins maps the square of every pinned piece of the player to the
+            step from the king towards the pinning piece. isLegal uses it to test moves without making them.
+        """
+        king_square = player.getPieceDict()[KING][0].getPosition()
+        own_pieces = 0 if player.getColor() == WHITE else 8
+        checkers = []
+        pins = {}
+
+        piece_dict = board.getOtherPlayer(player).getPieceDict()
+        for piece_type in piece_dict:
+            for piece in piece_dict[piece_type]:
+                square = piece.getPosition()
+                index = king_square - square + 119
+                if not ATTACK_MASKS[index] & 1 << piece.getCode():
+                    continue
+
+                if not piece_type & 4:
+                    checkers.append(square)
+                    continue
+
+                # Walk from the king towards the sliding piece. No piece in between is a check, one of the
+                # player's pieces is a pin.
+                step = -ATTACK_STEPS[index]
+                blockers = []
+                current_square = king_square + step
+                while current_square != square:
+                    if board.getPiece(current_square):
+                        blockers.append(current_square)
+                        if len(blockers) > 1:
+                            break
+                    current_square += step
+
+                if not blockers:
+                    checkers.append(square)
+                elif len(blockers) == 1 and board.getPiece(blockers[0]).getCode() & 8 == own_pieces:
+                    pins[blockers[0]] = step
+
+        return king_square, checkers, pins
+
+    def isLegal(self, move, board, player, check_info=None):
+        """ Returns True if the player's pseudo-legal move is legal. check_info is the tuple from getCheckInfo; it
+            is worked out if it isn't given, so pass it when testing many moves in the same position.
+        """
+        special_move = moveSpecial(move)
+        if special_move == SHORT_CASTLE:
+            square = moveOrigin(move)
+            while square < (moveTarget(move) + 1):
                 if board.isSquareUnderAttack(self, square, board.getOtherPlayer(player)):
                     return False
                 square += 1
+            return True
 
-        elif move.getSpecialMove() == LONG_CASTLE:
-            square = move.getOriginSquare()
-            while square > (move.getTargetSquare() - 2):
+        elif special_move == LONG_CASTLE:
+            square = moveOrigin(move)
+            while square > (moveTarget(move) - 1):
                 if board.isSquareUnderAttack(self, square, board.getOtherPlayer(player)):
                     return False
                 square -= 1
-                    
-        board.makeMove(move, player)
-        
-        if not self.isInCheck(board, player):
-            board.unmakeMove(move, player)
             return True
-        
-        board.unmakeMove(move, player)
-            
+
+        # En passant takes two pieces off a line at once and can uncover a check along the rank, so it is made.
+        elif special_move == EN_PASSANT:
+            board.makeMove(move, player)
+            legal = not self.isInCheck(board, player)
+            board.unmakeMove(move, player)
+            return legal
+
+        if check_info is None:
+            check_info = self.getCheckInfo(board, player)
+        king_square, checkers, pins = check_info
+        origin_square = move >> 7 & 0x7f
+        target_square = move & 0x7f
+
+        # The king can't move to an attacked square, nor step back along the line of a sliding checker.
+        if origin_square == king_square:
+            for checker in checkers:
+                if target_square == king_square + ATTACK_STEPS[king_square - checker + 119] and \
+                   board.getPiece(checker).getType() & 4:
+                    return False
+            return not board.isSquareUnderAttack(self, target_square, board.getOtherPlayer(player))
+
+        # Only the king can escape a double check.
+        if len(checkers) > 1:
+            return False
+
+        # A pinned piece can only move along the line of the pin.
+        if origin_square in pins and ATTACK_STEPS[target_square - king_square + 119] != pins[origin_square]:
+            return False
+
+        # A single check has to be captured or blocked.
+        if checkers:
+            checker = checkers[0]
+            if target_square == checker:
+                return True
+            if not board.getPiece(checker).getType() & 4:
+                return False
+            step = ATTACK_STEPS[checker - king_square + 119]
+            return ATTACK_STEPS[target_square - king_square + 119] == step and \
+                   ATTACK_STEPS[checker - target_square + 119] == step
+
+        return True
+
+    def givesCheck(self, move, board, player):
+        """ Returns True if the player's legal move checks the other player's king. """
+        special_move = moveSpecial(move)
+        if special_move in (EN_PASSANT, SHORT_CASTLE, LONG_CASTLE):
+            other_player = board.getOtherPlayer(player)
+            board.makeMove(move, player)
+            check = self.isInCheck(board, other_player)
+            board.unmakeMove(move, player)
+            return check
+
+        origin_square = move >> 7 & 0x7f
+        target_square = move & 0x7f
+        king_square = board.getOtherPlayer(player).getPieceDict()[KING][0].getPosition()
+        piece_code = move >> 24 & 0xf
+        if special_move == PROMOTION:
+            piece_code = piece_code & 8 | move >> 17 & 0x7
+
+        # Direct check. The origin square is empty after the move.
+        index = king_square - target_square + 119
+        if ATTACK_MASKS[index] & 1 << piece_code:
+            if not piece_code & 4:
+                return True
+            step = ATTACK_STEPS[index]
+            square = target_square + step
+            while square != king_square and (square == origin_square or not board.getPiece(square)):
+                square += step
+            if square == king_square:
+                return True
+
+        # Discovered check: the piece leaves a line between the king and one of the player's sliding pieces.
+        step = ATTACK_STEPS[origin_square - king_square + 119]
+        if step and ATTACK_STEPS[target_square - king_square + 119] != step:
+            square = king_square + step
+            while square != origin_square:
+                if board.getPiece(square):
+                    return False
+                square += step
+            square += step
+            while not square & 0x88:
+                piece = board.getPiece(square)
+                if piece:
+                    if piece.getColor() != player.getColor() or not piece.getType() & 4:
+                        return False
+                    return bool(ATTACK_MASKS[king_square - square + 119] & 1 << piece.getCode())
+                square += step
+
         return False
-        
+
     def isInCheck(self, board, player):
         """ Returns True if player's king is in check. """
         # get opponent's Player object.
@@ -769,11 +1434,12 @@ class Rules(object):
 
         king_pos = player.getPieceDict()[KING][0].getPosition()
         king_delta = player.getPieceDict()[KING][0].getDelta()
+        check_info = self.getCheckInfo(board, player)
         
         for move_in_delta in king_delta:
-            move = board.createMoveObject(king_pos, king_pos + move_in_delta, player)
+            move = board.createMove(king_pos, king_pos + move_in_delta, player)
             if self.isPseudoLegal(move, board, player):
-                if self.isLegal(move, board, player):
+                if self.isLegal(move, board, player, check_info):
                     return False
 
         piece_dict = player.getPieceDict()
@@ -793,6 +1459,7 @@ class Rules(object):
             return False
 
         piece_dict = player.getPieceDict()
+        check_info = self.getCheckInfo(board, player)
 
         for piece_type in piece_dict:
             for piece in piece_dict[piece_type]:
@@ -800,63 +1467,194 @@ class Rules(object):
                 piece_delta = piece.getDelta()
                 for move_in_delta in piece_delta:
                     target_square = piece_pos + move_in_delta
-                    move = board.createMoveObject(piece_pos, target_square, player)
+                    move = board.createMove(piece_pos, target_square, player)
 
                     if self.isPseudoLegal(move, board, player):
-                        if self.isLegal(move, board, player):
+                        if self.isLegal(move, board, player, check_info):
                             return False
 
                     if piece_type & 4:
                         while not target_square & 0x88 and not board.getPiece(target_square):
                             target_square += move_in_delta
-                            move_object = board.createMoveObject(piece_pos, target_square, player)
+                            move = board.createMove(piece_pos, target_square, player)
                             if self.isPseudoLegal(move, board, player):
-                                if self.isLegal(move, board, player):
+                                if self.isLegal(move, board, player, check_info):
                                     return False
 
         return True
 
-    def isMaterialDraw(self):
-        """ Returns True if game is a draw due to lack of material. """
-        # Boolenas for draw by material detection. 
-        white_has_bishop = False
-        white_has_knight = False
-        black_has_bishop = False
-        black_has_knight = False 
-        
-        for piece_type in white_player.getPieceDict():
-            for piece in white_player.getPieceDict()[piece_type]:
-                # Check pieces for draw by material detections.  
-                if piece_type == PAWN or piece_type == QUEEN or piece_type == ROOK:
-                    return False 
-                elif (piece_type == BISHOP or piece_type == KNIGHT) and (white_has_knight or white_has_bishop):
-                    return False 
-                elif piece_type == BISHOP:
-                    white_has_bishop = True
-                elif piece_type == KNIGHT:
-                    white_has_knight = True
-
-        for piece_type in black_player.getPieceDict():
-            for piece in black_player.getPieceDict()[piece_type]:
-                # Check pieces for draw by material detection.
-                if piece_type == PAWN or piece_type == QUEEN or piece_type == ROOK:
-                    return False 
-                elif (piece_type == BISHOP or piece_type == KNIGHT) and (black_has_bishop or black_has_knight):
-                    return False 
-                elif piece_type == BISHOP:
-                    black_has_bishop = True
-                elif piece_type == KNIGHT:
-                    black_has_knight = True
+    def isMaterialDraw(self, board):
+        """ Returns True if game is a draw due to lack of material: no pawns, rooks or queens and at most one
+            bishop or knight on each side.
+        """
+        for color in WHITE, BLACK:
+            if board.getBitboard(PAWN, color) or board.getBitboard(ROOK, color) or board.getBitboard(QUEEN, color):
+                return False
+            minor_pieces = board.getBitboard(KNIGHT, color) | board.getBitboard(BISHOP, color)
+            if minor_pieces & (minor_pieces - 1):  # More than one.
+                return False
 
         return True
 
 
-class Engine(object):              
-                                   
+class TranspositionTable(object):
+
+    # Rough size of one entry in bytes (the tuple plus its 64-bit key).
+    ENTRY_SIZE = 144
+
+    def __init__(self, size=HASH_SIZE):
+        """ Allocates a table of size megabytes. Every bucket has two slots: the first one keeps the deepest
+            entry, the second one is always replaced.
+        """
+        self.buckets = max(1, size * 1024 * 1024 // (2 * self.ENTRY_SIZE))
+        self.entries = [None] * (2 * self.buckets)
+        self.generation = 0
+
+    def clear(self):
+        """ Removes all the entries from the table. """
+        self.entries = [None] * (2 * self.buckets)
+        self.generation = 0
+
+    def newSearch(self):
+        """ Starts a new search. Entries from older searches are replaced first. """
+        self.generation += 1
+
+    def probe(self, hash_key, ply):
+        """ Returns a (depth, bound, score, move key) tuple for the position, or None if it isn't stored. """
+        index = (hash_key % self.buckets) * 2
+        entry = self.entries[index]
+        if not entry or entry[0] != hash_key:
+            entry = self.entries[index + 1]
+            if not entry or entry[0] != hash_key:
+                return None
+
+        return entry[1], entry[2], self.scoreFromTable(entry[3], ply), entry[4]
+
+    def store(self, hash_key, depth, bound, score, move_key, ply):
+        """ Stores a search result. Mate scores are kept relative to the position, not to the search depth. """
+        score = self.scoreToTable(score, ply)
+        index = (hash_key % self.buckets) * 2
+        deepest = self.entries[index]
+        if deepest and deepest[0] == hash_key and move_key is None:
+            move_key = deepest[4]  # Keep the old best move.
+
+        entry = (hash_key, depth, bound, score, move_key, self.generation)
+        if not deepest or deepest[5] != self.generation or depth >= deepest[1]:
+            self.entries[index] = entry
+        else:
+            self.entries[index + 1] = entry
+
+    def scoreToTable(self, score, ply):
+        """ Converts a mate score from distance to the root to distance to the position. """
+        if score >= MATE_BOUND:
+            return score - ply
+        elif score <= -MATE_BOUND:
+            return score + ply
+        return score
+
+    def scoreFromTable(self, score, ply):
+        """ Converts a stored mate score back to distance to the root. """
+        if score >= MATE_BOUND:
+            return score + ply
+        elif score <= -MATE_BOUND:
+            return score - ply
+        return score
+
+
+class PawnHashTable(object):
+
+    # Rough size of one entry in bytes (the tuple plus its key, scores and masks).
+    ENTRY_SIZE = 160
+
+    def __init__(self, size=PAWN_HASH_SIZE):
+        """ Allocates a table of size megabytes. Pawn structures repeat so often in a search that one slot per
+            index, always replaced, is enough.
+        """
+        self.slots = max(1, size * 1024 * 1024 // self.ENTRY_SIZE)
+        self.entries = [None] * self.slots
+
+    def clear(self):
+        """ Removes all the entries from the table. """
+        self.entries = [None] * self.slots
+
+    def probe(self, pawn_key):
+        """ Returns a (middle game score, end game score, white passed pawns, black passed pawns) tuple for the
+            pawn structure, or None if it isn't stored.
+        """
+        entry = self.entries[pawn_key % self.slots]
+        if entry and entry[0] == pawn_key:
+            return entry[1:]
+        return None
+
+    def store(self, pawn_key, middle_game_score, end_game_score, white_passed, black_passed):
+        """ Stores the evaluation of a pawn structure. The scores are for white and the passed pawns are
+            bitboards.
+        """
+        self.entries[pawn_key % self.slots] = (pawn_key, middle_game_score, end_game_score, white_passed,
+                                               black_passed)
+
+
+# MVV / LVA move ordering scores by victim and attacker type: the most valuable victim first, then the least
+# valuable attacker.
+MVV_LVA = [[0] * 8 for piece_type in range(8)]
+for victim_rank, victim in enumerate((PAWN, KNIGHT, BISHOP, ROOK, QUEEN)):
+    for attacker_rank, attacker in enumerate((KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN)):
+        MVV_LVA[victim][attacker] = victim_rank * 6 + attacker_rank
+
+# Late move reductions by remaining depth and move number. Later moves at deeper nodes are reduced more, but
+# never so much that less than one ply is left.
+LMR_REDUCTIONS = [[0] * 64 for depth in range(MAX_DEPTH + 1)]
+for depth in range(1, MAX_DEPTH + 1):
+    for move_number in range(1, 64):
+        reduction = int(0.5 + math.log(depth) * math.log(move_number) / 2)
+        LMR_REDUCTIONS[depth][move_number] = max(0, min(depth - 2, reduction))
+
+
+class Engine(object):
+
+    def __init__(self, hash_size=HASH_SIZE, transposition_table=None, book=None, tablebase=None):
+        """ Sets up the transposition table. It is kept between searches. A table can be passed in to share it
+            with other engines. If an opening book is given, book moves are played without a search. If an endgame
+            tablebase is given, positions in it are scored from it.
+        """
+        if transposition_table is None:
+            transposition_table = TranspositionTable(hash_size)
+        self.transposition_table = transposition_table
+        self.book = book
+        self.tablebase = tablebase
+        self.pawn_table = PawnHashTable()
+        self.nodes = 0
+        self.quiescence_nodes = 0
+        self.stop = False
+        self.start_depth = 1  # Depth of the first iteration.
+        self.see_pruning = QUIESCENCE_SEE_PRUNING
+        self.delta_pruning = DELTA_PRUNING
+        self.quiescence_depth = QUIESCENCE_DEPTH
+        self.killers = []
+
+        # Butterfly history table of quiet move scores by side, origin square and target square. The index is the
+        # color bit of the moved piece followed by the move key. It is kept between searches, but aged.
+        self.history = [0] * 0x8000
+        self.current_depth = 1
+        self.iterations = []
+        self.setLimits(None, None, None, 0, None)
+
+    def getNodeCount(self):
+        """ Returns the number of nodes visited by the last search. """
+        return self.nodes
+
+    def getQuiescenceNodeCount(self):
+        """ Returns the number of the last search's nodes that were visited by the quiescence search. """
+        return self.quiescence_nodes
+
+    def getIterations(self):
+        """ Returns a (depth, score, nodes, seconds, best move) tuple for every iteration the last search finished. """
+        return self.iterations
+
     def mateCheck(self, rules, board, player, ply):
-        """ Checks for checkmate and stalemate. """
+        """ Scores a position where the player has no legal moves: checkmate or stalemate. """
         # Check for checkmate.
-        if rules.isCheckMate(board, player):
+        if rules.isInCheck(board, player):
             return -(MATE_VALUE + ply)
 
         # Check for stalemate.
@@ -864,382 +1662,506 @@ class Engine(object):
             return DRAW_VALUE
 
     def positionEvaluation(self, board, rules, player):
-        """ Evaluates the current position on board. """
-        if rules.isCheckMate(board, player):  # Check for checkmate. 
-            return -MATE_VALUE
-
-        elif rules.isStaleMate(board, player):  # Check for stalemate.
+        """ Evaluates the current position on board. The score is static: checkmate and stalemate are found by the
+            search, where the side to move has no legal moves.
+        """
+        if board.getMoveCount() >= 50 or rules.isMaterialDraw(board):
             return DRAW_VALUE
 
-        value = 0
-
-        # Booleans for draw by material detection. 
-        draw_by_material = True
-        white_has_bishop = False
-        white_has_knight = False
-        black_has_bishop = False
-        black_has_knight = False
+        # Passed pawns with a piece in front of them are worth less. That depends on the pieces too, so it isn't
+        # part of the cached pawn structure score.
+        middle_game_score, end_game_score, white_passed, black_passed = self.pawnStructure(board)
+        occupied = board.getOccupancy(WHITE) | board.getOccupancy(BLACK)
+        blocked = bin(white_passed >> 8 & occupied).count('1') - bin(black_passed << 8 & occupied).count('1')
+        middle_game_score += board.getMiddleGameScore() - blocked * BLOCKED_PASSED_PAWN_PENALTY[0]
+        end_game_score += board.getEndGameScore() - blocked * BLOCKED_PASSED_PAWN_PENALTY[1]
 
-        # Booleans for material on board detection.
-        white_end_game = False
-        white_end_game = False
-        white_pieces = 0
-        black_pieces = 0
-        
-        for piece_type in white_player.getPieceDict():
-            for piece in white_player.getPieceDict()[piece_type]:
-                piece_value = piece.getValue()
-                value += piece_value
-                white_pieces += piece_value
-                value += piece.getPieceTableValue()
-                # Check pieces for draw by material detections.  
-                if piece_type == PAWN or piece_type == QUEEN or piece_type == ROOK:
-                    draw_by_material = False
-                elif (piece_type == BISHOP or piece_type == KNIGHT) and (white_has_knight or white_has_bishop):
-                    draw_by_material = False
-                elif piece_type == BISHOP:
-                    white_has_bishop = True
-                elif piece_type == KNIGHT:
-                    white_has_knight = True
-
-        for piece_type in black_player.getPieceDict():
-            for piece in black_player.getPieceDict()[piece_type]:
-                piece_value = piece.getValue()
-                value -= piece_value
-                black_pieces += piece_value
-                value -= piece.getPieceTableValue()
-                # Check pieces for draw by material detection.
-                if piece_type == PAWN or piece_type == QUEEN or piece_type == ROOK:
-                    draw_by_material = False
-                elif (piece_type == BISHOP or piece_type == KNIGHT) and (black_has_bishop or black_has_knight):
-                    draw_by_material = False
-                elif piece_type == BISHOP:
-                    black_has_bishop = True
-                elif piece_type == KNIGHT:
-                    black_has_knight = True
-                    
-        if draw_by_material or board.getMoveCount() >= 50:
-            return DRAW_VALUE
+        # Blend the middle game and end game scores by the game phase.
+        phase = min(board.getPhase(), TOTAL_PHASE)
+        value = (middle_game_score * phase + end_game_score * (TOTAL_PHASE - phase)) // TOTAL_PHASE
 
-        if white_pieces <= 21300 and black_pieces <= 21300:
-            white_player.getPieceDict()[KING][0].insertNewPieceTable(WHITE_KING_END_TABLE)
-            black_player.getPieceDict()[KING][0].insertNewPieceTable(BLACK_KING_END_TABLE)
+        return value * player.getColor()
 
-        else:
-            white_player.getPieceDict()[KING][0].insertNewPieceTable(WHITE_KING_MIDDLE_TABLE)
-            black_player.getPieceDict()[KING][0].insertNewPieceTable(BLACK_KING_MIDDLE_TABLE)
+    def pawnStructure(self, board):
+        """ Returns the (middle game score, end game score, white passed pawns, black passed pawns) tuple of the
+            pawns on the board: doubled, isolated and passed pawn scores for white, and passed pawn bitboards. It
+            comes from the pawn hash table if the pawn structure is stored there.
+        """
+        pawn_key = board.getPawnKey()
+        entry = self.pawn_table.probe(pawn_key)
+        if entry:
+            return entry
+
+        middle_game_score = end_game_score = 0
+        passed = {WHITE: 0, BLACK: 0}
+        for color in WHITE, BLACK:
+            pawns = board.getBitboard(PAWN, color)
+            enemy_pawns = board.getBitboard(PAWN, -color)
+            remaining = pawns
+            while remaining:
+                bit = remaining & -remaining
+                remaining ^= bit
+                index = bit.bit_length() - 1
+                column = index & 7
+                front = PASSED_PAWN_MASKS[color][index]
+
+                # Only the front pawn of a doubled pawn can be passed.
+                if pawns & front & FILE_MASKS[column]:
+                    middle_game_score -= DOUBLED_PAWN_PENALTY[0] * color
+                    end_game_score -= DOUBLED_PAWN_PENALTY[1] * color
+                elif not enemy_pawns & front:
+                    passed[color] |= bit
+                    rank = 7 - (index >> 3) if color == WHITE else index >> 3
+                    middle_game_score += PASSED_PAWN_BONUS[rank][0] * color
+                    end_game_score += PASSED_PAWN_BONUS[rank][1] * color
+
+                if not pawns & ADJACENT_FILE_MASKS[column]:
+                    middle_game_score -= ISOLATED_PAWN_PENALTY[0] * color
+                    end_game_score -= ISOLATED_PAWN_PENALTY[1] * color
+
+        self.pawn_table.store(pawn_key, middle_game_score, end_game_score, passed[WHITE], passed[BLACK])
+        return middle_game_score, end_game_score, passed[WHITE], passed[BLACK]
+
+    def setLimits(self, max_depth, movetime, time_left, increment, max_nodes):
+        """ Works out the depth, time and node limits of a search. Times are in seconds. """
+        self.start_time = time.time()
+        self.soft_limit = None  # No new iteration is started after this.
+        self.hard_limit = None  # The search is stopped after this.
+        self.node_limit = max_nodes
+
+        if movetime is not None:
+            self.soft_limit = self.hard_limit = movetime
+
+        elif time_left is not None:
+            allocated = time_left / MOVES_TO_GO + increment
+            self.soft_limit = min(allocated, time_left / 4)
+            self.hard_limit = min(allocated * 4, time_left / 2)
+
+        if max_depth is None:
+            if self.hard_limit is None and self.node_limit is None:
+                max_depth = DEFAULT_DEPTH
+            else:
+                max_depth = MAX_DEPTH
+
+        self.max_depth = max_depth
+        self.next_check = CHECK_INTERVAL
+        if self.node_limit is not None:
+            self.next_check = min(self.next_check, self.node_limit)
+
+    def checkLimits(self):
+        """ Called every CHECK_INTERVAL nodes. Sets the stop flag if the time or node budget is used up. """
+        self.next_check = self.nodes + CHECK_INTERVAL
+        if self.node_limit is not None:
+            if self.nodes >= self.node_limit:
+                self.stop = True
+            else:
+                # Check again as the limit is reached. Past it, only the first iteration goes on, at the usual
+                # interval.
+                self.next_check = min(self.next_check, self.node_limit)
+
+        if self.hard_limit is not None and time.time() - self.start_time >= self.hard_limit:
+            self.stop = True
+
+        # The first iteration always finishes, so there is a move to play.
+        if self.current_depth == self.start_depth:
+            self.stop = False
+
+    def iterativeDeepening(self, board, rules, player, max_depth=None, movetime=None, time_left=None, increment=0,
+                           max_nodes=None):
+        """ Iterative deepening framework. Returns the optimal move sequenece for player.
+            The search stops at max_depth, after movetime seconds, when the share of the remaining clock time
+            (time_left plus increment) is used up or after max_nodes nodes. Without any limit it searches to
+            DEFAULT_DEPTH. An unfinished iteration is thrown away.
+        """
+        self.setLimits(max_depth, movetime, time_left, increment, max_nodes)
+        self.nodes = 0
+        self.quiescence_nodes = 0
+        self.iterations = []
 
-        return value * player.getColor()
+        if self.book is not None:
+            book_move = self.book.chooseMove(board, rules, player)
+            if book_move:
+                return [book_move]
 
-    def iterativeDeepening(self, board, rules, player):
-        """ Iterative deepening framework. Returns the optimal move sequenece for player. """
+        self.stop = False
         self.pv = []
         self.prev_pv = []
         self.use_pv = False
-        self.current_depth = 1
-        alpha = -150000
-        beta = 150000
+        self.current_depth = self.start_depth
+        self.transposition_table.newSearch()
+        self.killers = [[0, 0] for i in range(self.max_depth + 1)]
+        self.history = [score >> HISTORY_AGING for score in self.history]
         
-        while self.current_depth < 5:
-            self.use_null_move = False
+        while self.current_depth <= self.max_depth:
             ply = self.current_depth
-            
-            current_eval = self.alphaBeta(board, rules, alpha, beta, ply, player, self.pv)
+            use_pv = self.use_pv
+
+            # Aspiration window: search a narrow window around the previous iteration's score and widen it on the
+            # side the score falls out of. Mate scores get the full window.
+            alpha = -150000
+            beta = 150000
+            window = ASPIRATION_WINDOW
+            if self.iterations and abs(self.iterations[-1][1]) < MATE_BOUND:
+                previous_eval = self.iterations[-1][1]
+                alpha = previous_eval - window
+                beta = previous_eval + window
+
+            while True:
+                self.use_null_move = False
+                self.use_pv = use_pv
+                self.pv = []
+                current_eval = self.alphaBeta(board, rules, alpha, beta, ply, player, self.pv)
+                if self.stop:
+                    break
+
+                window *= 2
+                if current_eval <= alpha and alpha > -150000:
+                    alpha = previous_eval - window if window < ASPIRATION_LIMIT else -150000
+                elif current_eval >= beta and beta < 150000:
+                    beta = previous_eval + window if window < ASPIRATION_LIMIT else 150000
+                else:
+                    break
+
+            if self.stop:
+                break
             
             self.use_pv = True            
             self.prev_pv = self.pv
             self.pv = []
+            self.iterations.append((self.current_depth, current_eval, self.nodes, time.time() - self.start_time,
+                                    self.prev_pv[0] if self.prev_pv else None))
 
             self.current_depth += 1
 
             if abs(current_eval) >= MATE_VALUE:
                 break
+
+            if self.soft_limit is not None and time.time() - self.start_time >= self.soft_limit:
+                break
+
+            # The node budget can be used up by the first iteration, which always finishes.
+            if self.node_limit is not None and self.nodes >= self.node_limit:
+                break
             
         return self.prev_pv
             
-    def moveOrdering(self, captures, non_captures, ply):
-        """ Orders the moves in the following order: pv, captures, non-captures. """
-        moves = self.captureOrdering(captures)
-        moves.extend(non_captures)
-        ordered_moves = []
+    def pickMoves(self, board, rules, player, ply, height, hash_move, check_info):
+        """ Yields the player's legal moves in stages: the hash move, the previous iteration's best move, captures
+            that don't lose material, killer moves, the other non-captures by history score and captures that lose
+            material. A stage is only generated when the ones before it have run out, so a node that is cut off
+            early doesn't pay for the rest. height is the node's distance from the root in plies.
+        """
+        tried = []  # Keys of the moves yielded so far.
+
+        # Use the best move from the transposition table and the previous iteration's best move.
+        best_keys = []
+        if hash_move is not None:
+            best_keys.append(hash_move)
+        if self.use_pv and ply > 1 and height < len(self.prev_pv):
+            best_keys.append(self.prev_pv[height] & 0x3fff)
+
+        for move_key in best_keys:
+            if move_key not in tried:
+                move = board.createMove(move_key >> 7, move_key & 0x7f, player)
+                if self.isValidMove(move, board, rules, player, check_info):
+                    tried.append(move_key)
+                    yield move
+
+        # Captures that win or keep material. The others are kept for last.
+        bad_captures = []
+        for score, move in self.scoreCaptures(board, board.generateCaptures(rules, player, check_info)):
+            if score < 0:
+                bad_captures.append(move)
+            elif move & 0x3fff not in tried:
+                yield move
+
+        # Killer moves, if they are legal non-captures here too.
+        for killer in self.killers[height]:
+            if killer and killer & 0x3fff not in tried:
+                move = board.createMove(killer >> 7 & 0x7f, killer & 0x7f, player)
+                if move == killer and self.isValidMove(move, board, rules, player, check_info):
+                    tried.append(killer & 0x3fff)
+                    yield move
+
+        for move in self.quietOrdering(board.generateNonCaptures(rules, player, check_info)):
+            if move & 0x3fff not in tried:
+                yield move
+
+        for move in bad_captures:
+            if move & 0x3fff not in tried:
+                yield move
+
+    def isValidMove(self, move, board, rules, player, check_info):
+        """ Returns True if a move from an earlier position, like the hash move, is legal in this one. """
+        return bool(move) and rules.isPseudoLegal(move, board, player) and \
+            rules.isLegal(move, board, player, check_info)
+
+    def quietOrdering(self, non_captures):
+        """ Orders non-captures by history score. """
+        history = self.history
+        return sorted(non_captures, key=lambda move: history[move >> 13 & 0x4000 | move & 0x3fff], reverse=True)
+
+    def updateQuietHeuristics(self, move, ply, height):
+        """ Records a non-capture that caused a beta cutoff as a killer move at its height and raises its history
+            score, more so the deeper the cutoff.
+        """
+        killers = self.killers[height]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
 
-        # Use the previous iteration's best move.
-        if self.use_pv and ply > 1:
-            pv_move = self.prev_pv[self.current_depth - ply]
-            ordered_moves.append(pv_move)
-            moves.remove(pv_move)
+        self.history[move >> 13 & 0x4000 | move & 0x3fff] += ply * ply
 
-        ordered_moves.extend(moves)
+    def captureOrdering(self, board, captures, skip_losing=False):
+        """ Orders captures by captureScore, best first. Captures that lose material are left out if skip_losing is
+            True.
+        """
+        return [move for score, move in self.scoreCaptures(board, captures) if score >= 0 or not skip_losing]
 
-        return ordered_moves
+    def scoreCaptures(self, board, captures):
+        """ Returns a list of (captureScore, move) pairs, best first. """
+        scored_moves = [(self.captureScore(board, move), move) for move in captures]
+        scored_moves.sort(key=itemgetter(0), reverse=True)
+        return scored_moves
 
-    def captureOrdering(self, captures):
-        """ Orders captures by the MVV / LVA scheme. """
-        ordered_moves = []
-        
-        PxQ = []
-        NxQ = []
-        BxQ = []
-        RxQ = []
-        QxQ = []
-        KxQ = []
-
-        PxR = []
-        NxR = []
-        BxR = []
-        RxR = []
-        QxR = []
-        KxR = []
-
-        PxB = []
-        NxB = []
-        BxB = []
-        RxB = []
-        QxB = []
-        KxB = []
-
-        PxN = []
-        NxN = []
-        BxN = []
-        RxN = []
-        QxN = []
-        KxN = []
-
-        PxP = []
-        NxP = []
-        BxP = []
-        RxP = []
-        QxP = []
-        KxP = []
-
-        for move in captures:
-            attacker = move.getPiece().getType()
-            victim = move.getCapturedPiece().getType()
-
-            if victim == QUEEN:
-                if attacker == PAWN:
-                    PxQ.append(move)
-                elif attacker == KNIGHT:
-                    NxQ.append(move)
-                elif attacker == BISHOP:
-                    BxQ.append(move)
-                elif attacker == ROOK:
-                    RxQ.append(move)
-                elif attacker == QUEEN:
-                    QxQ.append(move)
-                else:
-                    KxQ.append(move)
-
-            elif victim == ROOK:
-                if attacker == PAWN:
-                    PxR.append(move)
-                elif attacker == KNIGHT:
-                    NxR.append(move)
-                elif attacker == BISHOP:
-                    BxR.append(move)
-                elif attacker == ROOK:
-                    RxR.append(move)
-                elif attacker == QUEEN:
-                    QxR.append(move)
-                else:
-                    KxR.append(move)
-
-            elif victim == BISHOP:
-                if attacker == PAWN:
-                    PxB.append(move)
-                elif attacker == KNIGHT:
-                    NxB.append(move)
-                elif attacker == BISHOP:
-                    BxB.append(move)
-                elif attacker == ROOK:
-                    RxB.append(move)
-                elif attacker == QUEEN:
-                    QxB.append(move)
-                else:
-                    KxB.append(move)
-
-            elif victim == KNIGHT:
-                if attacker == PAWN:
-                    PxN.append(move)
-                elif attacker == KNIGHT:
-                    NxN.append(move)
-                elif attacker == BISHOP:
-                    BxN.append(move)
-                elif attacker == ROOK:
-                    RxN.append(move)
-                elif attacker == QUEEN:
-                    QxN.append(move)
-                else:
-                    KxN.append(move)
-
-            elif victim == PAWN:
-                if attacker == PAWN:
-                    PxP.append(move)
-                elif attacker == KNIGHT:
-                    NxP.append(move)
-                elif attacker == BISHOP:
-                    BxP.append(move)
-                elif attacker == ROOK:
-                    RxP.append(move)
-                elif attacker == QUEEN:
-                    QxP.append(move)
-                else:
-                    KxP.append(move)
-
-        ordered_moves.extend(PxQ)
-        ordered_moves.extend(NxQ)
-        ordered_moves.extend(BxQ)
-        ordered_moves.extend(RxQ)
-        ordered_moves.extend(QxQ)
-        ordered_moves.extend(KxQ)
-
-        ordered_moves.extend(PxR)
-        ordered_moves.extend(NxR)
-        ordered_moves.extend(BxR)
-        ordered_moves.extend(RxR)
-        ordered_moves.extend(QxR)
-        ordered_moves.extend(KxR)
-
-        ordered_moves.extend(PxB)
-        ordered_moves.extend(NxB)
-        ordered_moves.extend(BxB)
-        ordered_moves.extend(RxB)
-        ordered_moves.extend(QxB)
-        ordered_moves.extend(KxB)
-
-        ordered_moves.extend(PxN)
-        ordered_moves.extend(NxN)
-        ordered_moves.extend(BxN)
-        ordered_moves.extend(RxN)
-        ordered_moves.extend(QxN)
-        ordered_moves.extend(KxN)
-
-        ordered_moves.extend(PxP)
-        ordered_moves.extend(NxP)
-        ordered_moves.extend(BxP)
-        ordered_moves.extend(RxP)
-        ordered_moves.extend(QxP)
-        ordered_moves.extend(KxP)
-
-        return ordered_moves
-
-    def alphaBeta(self, board, rules, alpha, beta, ply, player, pv):
-        """ Implements a minimax algorithm with alpha-beta pruning. """
-        if ply <= 0:
-            return self.quiescenceSearch(board, rules, alpha, beta, player)
+    def captureScore(self, board, move):
+        """ Scores a capture for move ordering. Captures that win or keep material score their MVV / LVA value,
+            from 0 up; captures that lose material score their negative static exchange evaluation.
+        """
+        attacker = move >> 24 & 0x7  # Types of the moved and the captured piece.
+        victim = move >> 20 & 0x7
 
-        captures = board.generateCaptures(rules, player)
-        non_captures = board.generateNonCaptures(rules, player)
+        # Taking a piece worth at least the attacker never loses material.
+        if PIECE_VALUES[victim] < PIECE_VALUES[attacker]:
+            exchange = board.staticExchange(move)
+            if exchange < 0:
+                return exchange
 
-        if not len(captures) and not len(non_captures):
-            return self.mateCheck(rules, board, player, ply)
+        return MVV_LVA[victim][attacker]
+
+    def alphaBeta(self, board, rules, alpha, beta, ply, player, pv, height=0):
+        """ Implements a minimax algorithm with alpha-beta pruning. ply is the depth left to search and height the
+            distance from the root in plies, which reductions and the null move don't change.
+        """
+        if ply <= 0:
+            return self.quiescenceSearch(board, rules, alpha, beta, player)
 
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.checkLimits()
+        if self.stop:
+            return 0
+
+        # A repeated position is a draw: whatever the side to move could do better, it could have done the first
+        # time. Draws by threefold repetition come from lines like this one.
+        if ply != self.current_depth and board.isRepetition():
+            del pv[:]
+            return max(alpha, min(beta, DRAW_VALUE))
+
+        # Endgame tablebase lookup. Its distance to mate is exact, so it replaces the search below the position.
+        if self.tablebase is not None and ply != self.current_depth:
+            entry = self.tablebase.probe(board, player)
+            if entry:
+                result, distance = entry
+                del pv[:]
+                if result == TABLEBASE_DRAW:
+                    return max(alpha, min(beta, DRAW_VALUE))
+                return max(alpha, min(beta, result * (MATE_VALUE + ply - distance)))
+
+        # Transposition table lookup. The root is always searched so that it has a principal variation.
+        hash_key = board.getHashKey()
+        hash_move = None
+        entry = self.transposition_table.probe(hash_key, ply)
+        if entry:
+            hash_depth, bound, score, hash_move = entry
+            if hash_depth >= ply and ply != self.current_depth:
+                if bound == EXACT or (bound == LOWER_BOUND and score >= beta) or (bound == UPPER_BOUND and score <= alpha):
+                    del pv[:]  # The line below this position is not known.
+                    return max(alpha, min(beta, score))
+
+        check_info = rules.getCheckInfo(board, player)
         localpv = []
 
+        # Frontier nodes: the static evaluation tells if the position is hopeless. Not at the root, so it always
+        # gets a searched best move, and not when in check or when mate scores are involved.
+        futility_margin = None
+        if ply < len(FUTILITY_MARGINS) and ply != self.current_depth and not check_info[1] and \
+           -MATE_BOUND < alpha and beta < MATE_BOUND:
+            static_eval = self.positionEvaluation(board, rules, player)
+
+            # Razoring: far below alpha, only captures can help, so the quiescence search decides. Not at nodes
+            # on the principal variation.
+            if beta - alpha == 1 and static_eval + RAZOR_MARGINS[ply] <= alpha:
+                if ply == 1:
+                    return self.quiescenceSearch(board, rules, alpha, beta, player)
+
+                # Deeper, the captures must not even get back to alpha less the margin.
+                razor_alpha = alpha - RAZOR_MARGINS[ply]
+                current_eval = self.quiescenceSearch(board, rules, razor_alpha, razor_alpha + 1, player)
+                if self.stop:
+                    return 0
+                if current_eval <= razor_alpha:
+                    return alpha
+
+            # Futility pruning: quiet moves that don't give check are skipped below, except the first one.
+            if static_eval + FUTILITY_MARGINS[ply] <= alpha:
+                futility_margin = FUTILITY_MARGINS[ply]
+
         # Null move reduction.
         if self.use_null_move and not self.use_pv:
-            if not rules.isInCheck(board, player):
+            if not check_info[1]:  # Not in check.
                 R = 2
                 self.use_null_move = False
-                current_eval = -self.alphaBeta(board, rules, -beta, 1 - beta, ply - (R + 1), board.getOtherPlayer(player), localpv)
+                null_state = board.makeNullMove()
+                current_eval = -self.alphaBeta(board, rules, -beta, 1 - beta, ply - (R + 1), board.getOtherPlayer(player), localpv,
+                                               height + 1)
+                board.unmakeNullMove(null_state)
+
+                if self.stop:
+                    return 0
 
                 if current_eval >= beta:
                     return current_eval
 
-        move_list = self.moveOrdering(captures, non_captures, ply)
+        best_move = None
+        moves_searched = 0
 
-        for move in move_list:
-            if rules.isLegal(move, board, player):
-                board.makeMove(move, player)
-                self.use_null_move = True
-                current_eval = -self.alphaBeta(board, rules, -beta, -alpha, ply - 1, board.getOtherPlayer(player), localpv)
-                board.unmakeMove(move, player)
+        other_player = board.getOtherPlayer(player)
 
-                if current_eval >= beta:
-                    return beta
+        for move in self.pickMoves(board, rules, player, ply, height, hash_move, check_info):
+            moves_searched += 1
 
-                elif current_eval > alpha:
-                    self.use_pv = False
-                    
-                    # Extract the principal variation.
-                    if not pv:
-                        pv.append(move)
+            # Quiet moves after the first that don't give check can be pruned or reduced. The check test is only
+            # made when one of them applies.
+            late_move = moves_searched > LMR_FULL_DEPTH_MOVES and ply >= LMR_MIN_DEPTH and not check_info[1]
+            quiet = False
+            if moves_searched > 1 and not move & QUIET_MOVE_MASK and (futility_margin is not None or late_move):
+                quiet = not rules.givesCheck(move, board, player)
+
+            if futility_margin is not None and quiet:
+                continue
+
+            # Late move reduction: quiet moves late in the order are unlikely to be best, so they are searched
+            # less deep. Not when in check, and not for moves that give check.
+            reduction = 0
+            if late_move and quiet:
+                reduction = LMR_REDUCTIONS[min(ply, MAX_DEPTH)][min(moves_searched, 63)]
+
+            board.makeMove(move, player)
+            self.use_null_move = True
+            if moves_searched == 1:
+                current_eval = -self.alphaBeta(board, rules, -beta, -alpha, ply - 1, other_player, localpv, height + 1)
+
+            # Principal variation search: a null window shows the later moves are no better than the first, and
+            # only a move that turns out better is searched again with the full window.
+            else:
+                current_eval = -self.alphaBeta(board, rules, -alpha - 1, -alpha, ply - 1 - reduction, other_player,
+                                               localpv, height + 1)
+
+                # A reduced move that beats alpha is searched again to full depth.
+                if reduction and current_eval > alpha and not self.stop:
+                    self.use_null_move = True
+                    current_eval = -self.alphaBeta(board, rules, -alpha - 1, -alpha, ply - 1, other_player, localpv,
+                                                   height + 1)
+
+                if alpha < current_eval < beta and not self.stop:
+                    self.use_null_move = True
+                    current_eval = -self.alphaBeta(board, rules, -beta, -alpha, ply - 1, other_player, localpv,
+                                                   height + 1)
+            board.unmakeMove(move, player)
+
+            if self.stop:
+                return 0
+
+            if current_eval >= beta:
+                if not move & QUIET_MOVE_MASK:  # Neither a capture nor a promotion.
+                    self.updateQuietHeuristics(move, ply, height)
+                self.transposition_table.store(hash_key, ply, LOWER_BOUND, beta, move & 0x3fff, ply)
+                return beta
+
+            elif current_eval > alpha:
+                self.use_pv = False
+                best_move = move
+                
+                # Extract the principal variation.
+                if not pv:
+                    pv.append(move)
+                else:
+                    pv[0] = move
+
+                # Append local pv to global pv.
+                for i in range(len(localpv)):
+                    if len(pv) - 2 < i:
+                        pv.insert(i+1, localpv[i])
                     else:
-                        pv[0] = move
-
-                    # Append local pv to global pv.
-                    for i in range(len(localpv)):
-                        if len(pv) - 2 < i:
-                            pv.insert(i+1, localpv[i])
-                        else:
-                            pv[i+1] = localpv[i]
-                        
-                    alpha = current_eval
-            
+                        pv[i+1] = localpv[i]
+                    
+                alpha = current_eval
+
+        if not moves_searched:
+            return self.mateCheck(rules, board, player, ply)
+
+        if best_move:
+            self.transposition_table.store(hash_key, ply, EXACT, alpha, best_move & 0x3fff, ply)
+        else:
+            self.transposition_table.store(hash_key, ply, UPPER_BOUND, alpha, None, ply)
+
         return alpha
 
-    def quiescenceSearch(self, board, rules, alpha, beta, player):
+    def quiescenceSearch(self, board, rules, alpha, beta, player, depth=0):
+        """ Searches captures until the position is quiet. depth is the number of captures made since the main
+            search ended.
+        """
+        self.nodes += 1
+        self.quiescence_nodes += 1
+        if self.nodes >= self.next_check:
+            self.checkLimits()
+        if self.stop:
+            return 0
+
+        # Checkmate is only looked for when in check. Stalemate is left to the main search.
+        check_info = rules.getCheckInfo(board, player)
+        captures = None
+        if check_info[1]:
+            captures = board.generateCaptures(rules, player, check_info)
+            if not captures and not board.generateNonCaptures(rules, player, check_info):
+                return -MATE_VALUE
+
         stand_pat = self.positionEvaluation(board, rules, player)
         if stand_pat >= beta:
             return beta
 
         elif stand_pat > alpha:
             alpha = stand_pat
-            
-        captures = self.captureOrdering(board.generateCaptures(rules, player))
-        for move in captures:
-            if rules.isLegal(move, board, player):
-                board.makeMove(move, player)
-                current_eval = -self.quiescenceSearch(board, rules, -beta, -alpha, board.getOtherPlayer(player))
-                board.unmakeMove(move, player)
 
-                if current_eval >= beta:
-                    return beta
+        if self.quiescence_depth is not None and depth >= self.quiescence_depth:
+            return alpha
 
-                elif current_eval > alpha:
-                    alpha = current_eval
+        if captures is None:
+            captures = board.generateCaptures(rules, player, check_info)
 
-        return alpha 
-    
+        # Delta pruning: a capture that can't raise alpha even with a margin on top of the captured piece's value
+        # isn't searched. Not when in check, not for promotions and not in the endgame, where the evaluation
+        # swings more.
+        delta_pruning = self.delta_pruning and not check_info[1] and board.getPhase() > DELTA_PRUNING_PHASE
+        other_player = board.getOtherPlayer(player)
+
+        for move in self.captureOrdering(board, captures, self.see_pruning and not check_info[1]):
+            if delta_pruning and stand_pat + PIECE_VALUES[move >> 20 & 0x7] + DELTA_MARGIN <= alpha and \
+               not move >> 17 & 0x7:
+                continue
+
+            board.makeMove(move, player)
+            current_eval = -self.quiescenceSearch(board, rules, -beta, -alpha, other_player, depth + 1)
+            board.unmakeMove(move, player)
 
-# -------------------------------------------------------------------
-# Create instances of all of the piece objects! 
-# White piece objects. 
-white_pawn1 = Piece(PAWN, WHITE, 96, PAWN_VALUE, WHITE_PAWN_TABLE, 'graphics/white_pawn.png')
-white_pawn2 = Piece(PAWN, WHITE, 97, PAWN_VALUE, WHITE_PAWN_TABLE, 'graphics/white_pawn.png')
-white_pawn3 = Piece(PAWN, WHITE, 98, PAWN_VALUE, WHITE_PAWN_TABLE, 'graphics/white_pawn.png')
-white_pawn4 = Piece(PAWN, WHITE, 99, PAWN_VALUE, WHITE_PAWN_TABLE, 'graphics/white_pawn.png')
-white_pawn5 = Piece(PAWN, WHITE, 100, PAWN_VALUE, WHITE_PAWN_TABLE, 'graphics/white_pawn.png')
-white_pawn6 = Piece(PAWN, WHITE, 101, PAWN_VALUE, WHITE_PAWN_TABLE, 'graphics/white_pawn.png')
-white_pawn7 = Piece(PAWN, WHITE, 102, PAWN_VALUE, WHITE_PAWN_TABLE, 'graphics/white_pawn.png')
-white_pawn8 = Piece(PAWN, WHITE, 103, PAWN_VALUE, WHITE_PAWN_TABLE, 'graphics/white_pawn.png')
-white_knight1 = Piece(KNIGHT, WHITE, 113, KNIGHT_VALUE, WHITE_KNIGHT_TABLE, 'graphics/white_knight.png')
-white_knight2 = Piece(KNIGHT, WHITE, 118, KNIGHT_VALUE, WHITE_KNIGHT_TABLE, 'graphics/white_knight.png')
-white_bishop1 = Piece(BISHOP, WHITE, 114, BISHOP_VALUE, WHITE_BISHOP_TABLE, 'graphics/white_bishop.png')
-white_bishop2 = Piece(BISHOP, WHITE, 117, BISHOP_VALUE, WHITE_BISHOP_TABLE, 'graphics/white_bishop.png')
-white_rook1  = Piece(ROOK, WHITE, 112, ROOK_VALUE, WHITE_ROOK_TABLE, 'graphics/white_rook.png')
-white_rook2 = Piece(ROOK, WHITE, 119, ROOK_VALUE, WHITE_ROOK_TABLE, 'graphics/white_rook.png')
-white_queen = Piece(QUEEN, WHITE, 115, QUEEN_VALUE, WHITE_QUEEN_TABLE, 'graphics/white_queen.png')
-white_king = Piece(KING, WHITE, 116, KING_VALUE, WHITE_KING_MIDDLE_TABLE, 'graphics/white_king.png')
-
-# Black piece objects.
-black_pawn1 = Piece(PAWN, BLACK, 16, PAWN_VALUE, BLACK_PAWN_TABLE, 'graphics/black_pawn.png')
-black_pawn2 = Piece(PAWN, BLACK, 17, PAWN_VALUE, BLACK_PAWN_TABLE, 'graphics/black_pawn.png')
-black_pawn3 = Piece(PAWN, BLACK, 18, PAWN_VALUE, BLACK_PAWN_TABLE, 'graphics/black_pawn.png')
-black_pawn4 = Piece(PAWN, BLACK, 19, PAWN_VALUE, BLACK_PAWN_TABLE, 'graphics/black_pawn.png')
-black_pawn5 = Piece(PAWN, BLACK, 20, PAWN_VALUE, BLACK_PAWN_TABLE, 'graphics/black_pawn.png')
-black_pawn6 = Piece(PAWN, BLACK, 21, PAWN_VALUE, BLACK_PAWN_TABLE, 'graphics/black_pawn.png')
-black_pawn7 = Piece(PAWN, BLACK, 22, PAWN_VALUE, BLACK_PAWN_TABLE, 'graphics/black_pawn.png')
-black_pawn8 = Piece(PAWN, BLACK, 23, PAWN_VALUE, BLACK_PAWN_TABLE, 'graphics/black_pawn.png')
-black_knight1 = Piece(KNIGHT, BLACK, 1, KNIGHT_VALUE, BLACK_KNIGHT_TABLE, 'graphics/black_knight.png')
-black_knight2 = Piece(KNIGHT, BLACK, 6, KNIGHT_VALUE, BLACK_KNIGHT_TABLE, 'graphics/black_knight.png')
-black_bishop1 = Piece(BISHOP, BLACK, 2, BISHOP_VALUE, BLACK_BISHOP_TABLE, 'graphics/black_bishop.png')
-black_bishop2 = Piece(BISHOP, BLACK, 5, BISHOP_VALUE, BLACK_BISHOP_TABLE, 'graphics/black_bishop.png')
-black_rook1  = Piece(ROOK, BLACK, 0, ROOK_VALUE, BLACK_ROOK_TABLE, 'graphics/black_rook.png')
-black_rook2 = Piece(ROOK, BLACK, 7, ROOK_VALUE, BLACK_ROOK_TABLE, 'graphics/black_rook.png')
-black_queen = Piece(QUEEN, BLACK, 3, QUEEN_VALUE, BLACK_QUEEN_TABLE, 'graphics/black_quuen.png')
-black_king = Piece(KING, BLACK, 4, KING_VALUE, BLACK_KING_MIDDLE_TABLE, 'graphics/black_king.png')
-
-# Create player object instances!
-white_player = Player('sten', WHITE, HUMAN)
-black_player = Player('maria', BLACK, COMPUTER)
+            if self.stop:
+                return 0
+
+            if current_eval >= beta:
+                return beta
+
+            elif current_eval > alpha:
+                alpha = current_eval
+
+        return alpha
@@ -0,0 +1,158 @@
+# E P D   T E S T   S U I T E .
+
+""" Runs a file of EPD positions with best move (bm) or avoid move (am) operations through a pool of engines and
+    reports how many were solved, the time to solution and the aggregate search speed.
+
+    Usage: python epd.py FILE [--movetime SECONDS] [--depth N] [--nodes N] [--processes N] [--hash MB]
+"""
+
+import argparse
+import multiprocessing
+import time
+from engine import *
+
+
+def parseEpd(line):
+    """ Returns a dictionary with the FEN string and the operations of an EPD line. Raises ValueError if the
+        line is invalid.
+    """
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError('invalid EPD: %r' % line)
+
+    operations = {}
+    if len(fields) == 5:
+        for operation in fields[4].split(';'):
+            opcode, _, operands = operation.strip().partition(' ')
+            if opcode:
+                operations[opcode] = [operand.strip('"') for operand in operands.split()]
+
+    halfmove = operations.get('hmvc', ['0'])[0]
+    fullmove = operations.get('fmvn', ['1'])[0]
+    fen = ' '.join(fields[:4] + [halfmove, fullmove])
+    Board(fen=fen)  # Raises ValueError if the position is invalid.
+
+    return {'fen': fen,
+            'id': ' '.join(operations.get('id', [])),
+            'bm': [normalizeSan(san) for san in operations.get('bm', [])],
+            'am': [normalizeSan(san) for san in operations.get('am', [])]}
+
+
+def normalizeSan(san):
+    """ Removes check marks, annotations and '=' from a move in standard algebraic notation. """
+    return san.rstrip('+#!?').replace('=', '').replace('0', 'O')
+
+
+def isSolution(san, position):
+    """ Returns True if the move solves the position. """
+    if position['bm'] and san not in position['bm']:
+        return False
+    if position['am'] and san in position['am']:
+        return False
+    return True
+
+
+# Worker process state, set up once per process by initWorker.
+worker_engine = None
+worker_rules = None
+
+
+def initWorker(hash_size):
+    """ Creates the engine of a worker process. """
+    global worker_engine, worker_rules
+    worker_engine = Engine(hash_size)
+    worker_rules = Rules()
+
+
+def solvePosition(args):
+    """ Searches one position in a worker process. Returns a dictionary with the result. """
+    position, limits = args
+    board = Board(fen=position['fen'])
+    player = board.getSideToMove()
+    worker_engine.transposition_table.clear()
+
+    start = time.time()
+    pv = worker_engine.iterativeDeepening(board, worker_rules, player, **limits)
+    elapsed = time.time() - start
+    san = normalizeSan(board.getSan(worker_rules, pv[0], player)) if pv else None
+
+    # The time to solution is the time of the iteration from which on the best move was always right.
+    solution_time = None
+    for depth, score, nodes, seconds, move in worker_engine.getIterations():
+        if move and isSolution(normalizeSan(board.getSan(worker_rules, move, player)), position):
+            if solution_time is None:
+                solution_time = seconds
+        else:
+            solution_time = None
+
+    return {'id': position['id'],
+            'move': san,
+            'solved': san is not None and isSolution(san, position),
+            'solution_time': solution_time,
+            'nodes': worker_engine.getNodeCount(),
+            'time': elapsed}
+
+
+def runSuite(positions, limits, processes, hash_size):
+    """ Searches the positions in a pool of processes. Yields the results in order. """
+    pool = multiprocessing.Pool(processes, initWorker, (hash_size,))
+    try:
+        for result in pool.imap(solvePosition, [(position, limits) for position in positions]):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run an EPD test suite.')
+    parser.add_argument('file', help='EPD file with bm or am operations')
+    parser.add_argument('--movetime', type=float, help='search time per position in seconds')
+    parser.add_argument('--depth', type=int, help='search depth per position in plies')
+    parser.add_argument('--nodes', type=int, help='search nodes per position')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--hash', type=int, default=HASH_SIZE,
+                        help='transposition table size in megabytes per process')
+    args = parser.parse_args()
+
+    limits = {'max_depth': args.depth, 'movetime': args.movetime, 'max_nodes': args.nodes}
+    if args.movetime is None and args.depth is None and args.nodes is None:
+        limits['movetime'] = 5.0
+
+    positions = []
+    with open(args.file) as epd_file:
+        for line_number, line in enumerate(epd_file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                position = parseEpd(line)
+            except ValueError as error:
+                parser.error('line %d: %s' % (line_number, error))
+            if not position['id']:
+                position['id'] = 'line %d' % line_number
+            positions.append(position)
+
+    start = time.time()
+    solved = 0
+    total_nodes = 0
+    for position, result in zip(positions, runSuite(positions, limits, args.processes, args.hash)):
+        total_nodes += result['nodes']
+        expected = ' '.join(['bm'] + position['bm'] if position['bm'] else ['am'] + position['am'])
+        if result['solved']:
+            solved += 1
+            print('%s: %s (%s) solved in %.2f s' % (result['id'], result['move'], expected, result['solution_time']))
+        else:
+            print('%s: %s (%s) not solved' % (result['id'], result['move'], expected))
+    elapsed = time.time() - start
+
+    print('')
+    print('solved: %d / %d' % (solved, len(positions)))
+    print('nodes: %d' % total_nodes)
+    print('time: %.3f s' % elapsed)
+    print('nodes/sec: %d' % (total_nodes / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
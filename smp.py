@@ -0,0 +1,220 @@
+# L A Z Y   S M P .
+
+""" Parallel search. Helper processes search the same root position as the main process and share its transposition
+    table through shared memory. They start at staggered depths and order their quiet moves differently, so they
+    fill the table with entries the main search can use. The deepest finished result wins.
+"""
+
+import multiprocessing
+import random
+from multiprocessing import shared_memory
+from engine import *
+from tablebase import Tablebase
+
+
+class SharedTranspositionTable(TranspositionTable):
+
+    # Every slot is two 64-bit words: the key XORed with the data, and the data. A slot torn by two processes
+    # writing it at the same time fails the key check instead of returning a wrong entry, so no lock is needed.
+    SLOT_WORDS = 2
+    ENTRY_SIZE = 8 * SLOT_WORDS
+
+    # Data word layout: depth (8 bits), bound (2 bits), score (20 bits), move key (14 bits), generation (8 bits).
+    SCORE_OFFSET = 1 << 19
+
+    def __init__(self, memory, buckets):
+        """ Uses the shared memory block for buckets buckets of two slots each. The first word of the block holds
+            the generation of the current search.
+        """
+        self.buckets = buckets
+        self.words = self.memorySize(buckets) // 8
+        self.entries = memory.buf[:self.words * 8].cast('Q')
+        self.generation = 0
+
+    @classmethod
+    def memorySize(cls, buckets):
+        """ Returns the size in bytes of a table with buckets buckets. """
+        return 8 + buckets * 2 * cls.ENTRY_SIZE
+
+    @classmethod
+    def bucketCount(cls, size):
+        """ Returns the number of buckets in a table of size megabytes. """
+        return max(1, size * 1024 * 1024 // (2 * cls.ENTRY_SIZE))
+
+    def release(self):
+        """ Releases the view of the shared memory, so the block can be closed. """
+        self.entries.release()
+
+    def clear(self):
+        """ Removes all the entries from the table. """
+        view = self.entries.cast('B')
+        view[:] = bytes(len(view))
+        view.release()
+        self.generation = 0
+
+    def newSearch(self):
+        """ Picks up the generation of the current search. The main process advances it with nextGeneration. """
+        self.generation = self.entries[0]
+
+    def nextGeneration(self):
+        """ Starts a new search for every process sharing the table. """
+        self.entries[0] = (self.entries[0] + 1) & 0xff
+
+    def probe(self, hash_key, ply):
+        """ Returns a (depth, bound, score, move key) tuple for the position, or None if it isn't stored. """
+        index = 1 + (hash_key % self.buckets) * 2 * self.SLOT_WORDS
+        data = self.entries[index + 1]
+        if self.entries[index] ^ data != hash_key:
+            index += self.SLOT_WORDS
+            data = self.entries[index + 1]
+            if self.entries[index] ^ data != hash_key:
+                return None
+
+        score = ((data >> 10) & 0xfffff) - self.SCORE_OFFSET
+        move_key = (data >> 30) & 0x3fff
+        return data & 0xff, (data >> 8) & 0x3, self.scoreFromTable(score, ply), move_key or None
+
+    def store(self, hash_key, depth, bound, score, move_key, ply):
+        """ Stores a search result. Mate scores are kept relative to the position, not to the search depth. """
+        score = self.scoreToTable(score, ply)
+        index = 1 + (hash_key % self.buckets) * 2 * self.SLOT_WORDS
+        deepest = self.entries[index + 1]
+        same_key = self.entries[index] ^ deepest == hash_key
+        if same_key and move_key is None:
+            move_key = (deepest >> 30) & 0x3fff  # Keep the old best move.
+
+        data = (depth | bound << 8 | (score + self.SCORE_OFFSET) << 10 | (move_key or 0) << 30 |
+                self.generation << 44)
+        if not deepest or (deepest >> 44) != self.generation or depth >= deepest & 0xff:
+            self.entries[index] = hash_key ^ data
+            self.entries[index + 1] = data
+        else:
+            self.entries[index + 2] = hash_key ^ data
+            self.entries[index + 3] = data
+
+
+class HelperEngine(Engine):
+
+    def __init__(self, transposition_table, stop_flag, helper_id, tablebase=None):
+        """ Sets up a helper engine. It searches until the main process sets the shared stop flag. """
+        Engine.__init__(self, transposition_table=transposition_table, tablebase=tablebase)
+        self.stop_flag = stop_flag
+        self.random = random.Random(helper_id)
+
+        # Odd helpers start one iteration deeper than the main search.
+        self.start_depth = 1 + helper_id % 2
+
+    def checkLimits(self):
+        """ Stops the search when the main process is done. """
+        self.next_check = self.nodes + CHECK_INTERVAL
+        if self.stop_flag.value:
+            self.stop = True
+
+    def quietOrdering(self, non_captures):
+        """ Shuffles the non-captures before ordering them, so the helpers don't all search the same tree. """
+        self.random.shuffle(non_captures)
+        return Engine.quietOrdering(self, non_captures)
+
+
+def helperLoop(helper_id, memory_name, buckets, stop_flag, tasks, results, tablebase_path=None):
+    """ Runs in a helper process. Searches the (FEN, position key history, depth) tasks until it gets None and
+        puts a (depth, score, best move notation) tuple for every search in results. The helper maps the
+        tablebase file at tablebase_path itself, if there is one.
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    transposition_table = SharedTranspositionTable(memory, buckets)
+    tablebase = Tablebase(tablebase_path) if tablebase_path else None
+    engine = HelperEngine(transposition_table, stop_flag, helper_id, tablebase)
+    rules = Rules()
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            fen, key_history, max_depth = task
+            board = Board(fen=fen)
+            board.setKeyHistory(key_history)
+            pv = engine.iterativeDeepening(board, rules, board.getSideToMove(), max_depth)
+            iterations = engine.getIterations()
+            if pv and iterations:
+                results.put((iterations[-1][0], iterations[-1][1], moveNotation(pv[0])))
+            else:
+                results.put((0, 0, None))
+    finally:
+        if tablebase is not None:
+            tablebase.close()
+        transposition_table.release()
+        memory.close()
+
+
+class ParallelEngine(Engine):
+
+    def __init__(self, hash_size=HASH_SIZE, processes=SEARCH_PROCESSES, book=None, tablebase=None):
+        """ Creates the shared transposition table and starts processes - 1 helper processes. Call close when
+            done with the engine. Book moves are played by the main process without starting the helpers. The
+            helpers probe the tablebase too, each mapping its file.
+        """
+        buckets = SharedTranspositionTable.bucketCount(hash_size)
+        self.memory = shared_memory.SharedMemory(create=True, size=SharedTranspositionTable.memorySize(buckets))
+        Engine.__init__(self, transposition_table=SharedTranspositionTable(self.memory, buckets), book=book,
+                        tablebase=tablebase)
+
+        self.stop_flag = multiprocessing.RawValue('b', 0)
+        self.results = multiprocessing.Queue()
+        self.helpers = []
+        tablebase_path = tablebase.getPath() if tablebase is not None else None
+        for helper_id in range(1, processes):
+            tasks = multiprocessing.Queue()
+            process = multiprocessing.Process(target=helperLoop, args=(helper_id, self.memory.name, buckets,
+                                                                        self.stop_flag, tasks, self.results,
+                                                                        tablebase_path))
+            process.daemon = True
+            process.start()
+            self.helpers.append((process, tasks))
+
+    def close(self):
+        """ Stops the helper processes and frees the shared memory. """
+        for process, tasks in self.helpers:
+            tasks.put(None)
+        for process, tasks in self.helpers:
+            process.join()
+        self.helpers = []
+        self.transposition_table.release()
+        self.memory.close()
+        self.memory.unlink()
+
+    def iterativeDeepening(self, board, rules, player, max_depth=None, movetime=None, time_left=None, increment=0,
+                           max_nodes=None):
+        """ Searches with the helper processes. The limits apply to the main search; the helpers stop with it.
+            Returns the main search's optimal move sequence, or the best move of a helper that finished a
+            deeper iteration.
+        """
+        if self.book is not None:
+            book_move = self.book.chooseMove(board, rules, player)
+            if book_move:
+                self.iterations = []
+                return [book_move]
+
+        self.transposition_table.nextGeneration()
+        self.stop_flag.value = 0
+        fen = board.getFen()
+        key_history = board.getKeyHistory()
+        helper_depth = max_depth if max_depth is not None else MAX_DEPTH
+        for process, tasks in self.helpers:
+            tasks.put((fen, key_history, helper_depth))
+
+        pv = Engine.iterativeDeepening(self, board, rules, player, max_depth, movetime, time_left, increment,
+                                       max_nodes)
+
+        self.stop_flag.value = 1
+        depth = self.iterations[-1][0] if self.iterations else 0
+        for helper in self.helpers:
+            helper_depth, score, notation = self.results.get()
+            if helper_depth > depth and notation:
+                move = board.parseMove(rules, notation, player)
+                if move:
+                    depth = helper_depth
+                    pv = [move]
+
+        return pv
@@ -0,0 +1,532 @@
+# E N D G A M E   T A B L E B A S E .
+
+""" Endgame tablebases for a king and up to two pieces against a bare king (KQK, KRK, KPK, KBNK and the like),
+    made by retrograde analysis: from the mates backwards, one ply at a time, so every position gets its exact
+    distance to mate.
+
+    Tables index positions by the squares of the strong king, the weak king and the strong pieces. The board is
+    turned so that the strong side plays up the board and, by symmetry, the strong king is in the a1-d1-d4 triangle
+    (on files a-d with pawns). There is one byte per position and side to move: 0 for a draw, or the distance to
+    mate in plies plus 1. With the strong side to move that is a win, with the weak side to move a loss.
+
+    The file has a header, an index of the tables and the tables themselves. It is memory-mapped, so probing costs
+    no load time and processes share its pages.
+
+    Usage: python tablebase.py [ENDING ...] [--output FILE]
+"""
+
+import argparse
+import mmap
+import struct
+import time
+from engine import *
+
+TABLEBASE_MAGIC = b'TBLB'
+TABLEBASE_HEADER = struct.Struct('>4sHH')  # Magic, version, number of tables.
+TABLEBASE_ENTRY = struct.Struct('>8sQI')  # Ending name, offset of the tables, positions per side to move.
+TABLEBASE_VERSION = 1
+
+# Strong pieces are listed in this order in ending names.
+ENDING_PIECES = (QUEEN, ROOK, BISHOP, KNIGHT, PAWN)
+
+# Square tables. Squares are numbered rank * 8 + file, rank 0 being the strong side's first rank.
+SQUARE_FILES = [square & 7 for square in range(64)]
+SQUARE_RANKS = [square >> 3 for square in range(64)]
+
+
+def stepSquares(square, steps):
+    """ Returns the squares one (file, rank) step away from the square. """
+    squares = []
+    for file_step, rank_step in steps:
+        file, rank = SQUARE_FILES[square] + file_step, SQUARE_RANKS[square] + rank_step
+        if 0 <= file < 8 and 0 <= rank < 8:
+            squares.append(rank * 8 + file)
+    return squares
+
+
+def raySquares(square, step):
+    """ Returns the squares from the square to the edge of the board along a (file, rank) step. """
+    squares = []
+    file, rank = SQUARE_FILES[square] + step[0], SQUARE_RANKS[square] + step[1]
+    while 0 <= file < 8 and 0 <= rank < 8:
+        squares.append(rank * 8 + file)
+        file, rank = file + step[0], rank + step[1]
+    return squares
+
+
+DIAGONAL_STEPS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+STRAIGHT_STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+KNIGHT_JUMPS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+
+KING_SQUARES = [stepSquares(square, DIAGONAL_STEPS + STRAIGHT_STEPS) for square in range(64)]
+KNIGHT_SQUARES = [stepSquares(square, KNIGHT_JUMPS) for square in range(64)]
+SLIDER_STEPS = {BISHOP: DIAGONAL_STEPS, ROOK: STRAIGHT_STEPS, QUEEN: DIAGONAL_STEPS + STRAIGHT_STEPS}
+SLIDER_RAYS = dict((piece_type, [[raySquares(square, step) for step in steps] for square in range(64)])
+                   for piece_type, steps in SLIDER_STEPS.items())
+
+# Attack masks of the leapers, and of the sliders on an empty board. Strong pawns attack up the board.
+LEAPER_ATTACKS = {KING: [sum(1 << target for target in KING_SQUARES[square]) for square in range(64)],
+                  KNIGHT: [sum(1 << target for target in KNIGHT_SQUARES[square]) for square in range(64)],
+                  PAWN: [sum(1 << target for target in stepSquares(square, ((1, 1), (-1, 1))))
+                         for square in range(64)]}
+SLIDER_ATTACKS = dict((piece_type, [sum(1 << target for ray in rays[square] for target in ray)
+                                    for square in range(64)])
+                      for piece_type, rays in SLIDER_RAYS.items())
+
+# The squares between two squares on a line, by origin * 64 + target.
+BETWEEN_MASKS = [0] * 4096
+for square in range(64):
+    for ray in SLIDER_RAYS[QUEEN][square]:
+        mask = 0
+        for target in ray:
+            BETWEEN_MASKS[square * 64 + target] = mask
+            mask |= 1 << target
+
+# The eight symmetries of the board, as square maps.
+BOARD_SYMMETRIES = []
+for swap, flip_file, flip_rank in [(swap, flip_file, flip_rank) for swap in (False, True)
+                                   for flip_rank in (False, True) for flip_file in (False, True)]:
+    symmetry = []
+    for square in range(64):
+        file, rank = SQUARE_FILES[square], SQUARE_RANKS[square]
+        if swap:
+            file, rank = rank, file
+        if flip_file:
+            file = 7 - file
+        if flip_rank:
+            rank = 7 - rank
+        symmetry.append(rank * 8 + file)
+    BOARD_SYMMETRIES.append(symmetry)
+
+
+class Ending(object):
+
+    def __init__(self, name):
+        """ Sets up the indexing of an ending, given by its name, e.g. 'KBNK'. Raises ValueError if the ending
+            isn't a king and up to two pieces against a bare king.
+        """
+        letters = dict((PIECE_LETTERS[piece_type].upper(), piece_type) for piece_type in ENDING_PIECES)
+        if len(name) < 3 or len(name) > 5 or name[0] != 'K' or name[-1] != 'K' or \
+           any(letter not in letters for letter in name[1:-1]):
+            raise ValueError('unsupported ending: %r' % name)
+
+        self.name = name
+        self.piece_types = sorted((letters[letter] for letter in name[1:-1]), key=ENDING_PIECES.index)
+        if self.name != endingName(self.piece_types):
+            raise ValueError('unsupported ending: %r, pieces go in the order %s' % (name, endingName(ENDING_PIECES)))
+
+        # Squares of the strong king, the weak king and the strong pieces, and their types.
+        self.types = [KING, KING] + self.piece_types
+        self.has_pawns = PAWN in self.piece_types
+
+        # The strong king's square is moved into the canonical region. On the edge of the region two
+        # symmetries can do that; the one giving the lower index is used.
+        if self.has_pawns:
+            region = [square for square in range(64) if SQUARE_FILES[square] < 4]
+            symmetries = BOARD_SYMMETRIES[:2]
+        else:
+            region = [square for square in range(64) if SQUARE_RANKS[square] <= SQUARE_FILES[square] < 4]
+            symmetries = BOARD_SYMMETRIES
+        self.region = region
+        self.king_index = [-1] * 64
+        for index, square in enumerate(region):
+            self.king_index[square] = index
+        self.king_symmetries = [[symmetry for symmetry in symmetries if self.king_index[symmetry[square]] >= 0]
+                                for square in range(64)]
+        self.size = len(region) * 64 ** (len(self.types) - 1)
+
+        # Runs of pieces of the same type, whose squares are sorted.
+        self.groups = []
+        start = 2
+        for end in range(3, len(self.types) + 1):
+            if end == len(self.types) or self.types[end] != self.types[start]:
+                if end - start > 1:
+                    self.groups.append((start, end))
+                start = end
+
+    def getName(self):
+        return self.name
+
+    def getSize(self):
+        """ Returns the number of positions per side to move. """
+        return self.size
+
+    def getIndex(self, squares):
+        """ Returns the index of the position with the pieces on the squares, in the order strong king, weak king,
+            strong pieces.
+        """
+        best_index = None
+        for symmetry in self.king_symmetries[squares[0]]:
+            moved = [symmetry[square] for square in squares]
+            for start, end in self.groups:
+                moved[start:end] = sorted(moved[start:end])
+            index = self.king_index[moved[0]]
+            for square in moved[1:]:
+                index = index * 64 + square
+            if best_index is None or index < best_index:
+                best_index = index
+        return best_index
+
+    def getSquares(self, index):
+        """ Returns the squares of the position with the index. """
+        squares = []
+        for i in range(len(self.types) - 1):
+            index, square = divmod(index, 64)
+            squares.append(square)
+        squares.append(self.region[index])
+        squares.reverse()
+        return squares
+
+
+def endingName(piece_types):
+    """ Returns the name of the ending of a king and the pieces against a bare king. """
+    piece_types = sorted(piece_types, key=ENDING_PIECES.index)
+    return 'K' + ''.join(PIECE_LETTERS[piece_type].upper() for piece_type in piece_types) + 'K'
+
+
+def isDrawnMaterial(piece_types):
+    """ Returns True if a king and the pieces can't mate a bare king. """
+    return not piece_types or (len(piece_types) == 1 and piece_types[0] in (BISHOP, KNIGHT))
+
+
+class TablebaseGenerator(object):
+
+    def __init__(self):
+        """ Sets up the generator. Generated tables are kept, since larger endings need the smaller ones. """
+        self.tables = {}  # Ending name to an (ending, strong to move table, weak to move table) tuple.
+
+    def getTables(self):
+        """ Returns a dictionary of the generated tables by ending name. """
+        return self.tables
+
+    def isAttacked(self, target, squares, types, occupied):
+        """ Returns True if a strong piece attacks the target square. A piece on the target square is taken to be
+            captured.
+        """
+        for i in range(len(squares)):
+            square = squares[i]
+            if i == 1 or square == target:
+                continue
+            piece_type = types[i]
+            if piece_type & 4:
+                if SLIDER_ATTACKS[piece_type][square] >> target & 1 and \
+                   not BETWEEN_MASKS[square * 64 + target] & occupied:
+                    return True
+            elif LEAPER_ATTACKS[piece_type][square] >> target & 1:
+                return True
+        return False
+
+    def probeExit(self, piece_types, squares, strong_to_move):
+        """ Returns the distance to mate in plies of a position in a smaller ending, or None if it is a draw. """
+        if isDrawnMaterial(piece_types):
+            return None
+
+        # The squares are put in the order of the other ending's pieces.
+        pieces = sorted(zip(piece_types, squares[2:]), key=lambda piece: ENDING_PIECES.index(piece[0]))
+        name = endingName(piece_types)
+        if name not in self.tables:
+            self.generate(name)
+        ending, strong_table, weak_table = self.tables[name]
+        index = ending.getIndex(squares[:2] + [square for piece_type, square in pieces])
+        value = (strong_table if strong_to_move else weak_table)[index]
+        return value - 1 if value else None
+
+    def generate(self, name, verbose=False):
+        """ Generates the tables of the ending and of the smaller endings it can turn into. """
+        if name in self.tables:
+            return
+
+        start = time.time()
+        ending = Ending(name)
+        types = ending.types
+        piece_count = len(types)
+        size = ending.getSize()
+        strong_table = bytearray(size)
+        weak_table = bytearray(size)
+        is_attacked = self.isAttacked
+        get_index = ending.getIndex
+
+        def weakResult(squares):
+            """ Returns the distance to mate in plies of the weak side to move if every move of the weak king
+                loses, else None.
+            """
+            king_square = squares[1]
+            occupied = 0
+            for square in squares:
+                occupied |= 1 << square
+            occupied ^= 1 << king_square
+
+            longest = -1
+            has_move = False
+            for target in KING_SQUARES[king_square]:
+                if target == squares[0] or is_attacked(target, squares, types, occupied):
+                    continue
+                has_move = True
+                moved = list(squares)
+                moved[1] = target
+                if occupied >> target & 1:
+                    # Capture: the rest of the game is in a smaller ending.
+                    captured = moved.index(target, 2)
+                    value = self.probeExit(types[2:captured] + types[captured + 1:],
+                                           moved[:captured] + moved[captured + 1:], True)
+                    if value is None:
+                        return None
+                else:
+                    value = strong_table[get_index(moved)] - 1
+                    if value < 0:
+                        return None
+                if value > longest:
+                    longest = value
+
+            if not has_move:
+                # Checkmate, or stalemate.
+                return 0 if is_attacked(king_square, squares, types, occupied) else None
+            return longest + 1
+
+        # Positions decided by moves out of the ending, promotions by the strong side and captures by the weak king,
+        # waiting for their turn: distance to mate in plies to a list of indices. Odd distances are wins of the strong
+        # side to move, even ones losses of the weak side to move.
+        pending = {}
+
+        # Mates, weak side positions where every move is a losing capture, and promotions that win.
+        weak_frontier = []
+        for index in range(size):
+            squares = ending.getSquares(index)
+            if len(set(squares)) != piece_count or get_index(squares) != index or \
+               squares[1] in KING_SQUARES[squares[0]]:
+                continue
+            if any(types[i] == PAWN and not 0 < SQUARE_RANKS[squares[i]] < 7 for i in range(2, piece_count)):
+                continue
+
+            result = weakResult(squares)
+            if result == 0:
+                weak_table[index] = 1
+                weak_frontier.append(index)
+            elif result is not None:
+                pending.setdefault(result, []).append(index)
+
+            occupied = 0
+            for square in squares:
+                occupied |= 1 << square
+            if is_attacked(squares[1], squares, types, occupied ^ 1 << squares[1]):
+                continue  # With the weak king in check, the strong side can't be to move.
+
+            for i in range(2, piece_count):
+                if types[i] == PAWN and SQUARE_RANKS[squares[i]] == 6 and not occupied >> (squares[i] + 8) & 1:
+                    promoted = list(squares)
+                    promoted[i] += 8
+                    value = self.probeExit(types[2:i] + [QUEEN] + types[i + 1:], promoted, False)
+                    if value is not None:
+                        pending.setdefault(value + 1, []).append(index)
+
+        # Retrograde analysis, one ply at a time: a strong side position is won in n + 1 plies if a move leads to
+        # a weak side position lost in n plies; a weak side position is lost when all its moves lose.
+        distance = 0
+        while weak_frontier or pending:
+            strong_frontier = []
+            for weak_index in weak_frontier:
+                squares = ending.getSquares(weak_index)
+                occupied = 0
+                for square in squares:
+                    occupied |= 1 << square
+
+                # Take back every strong move that could have led here.
+                for i in range(piece_count):
+                    if i == 1:
+                        continue
+                    square = squares[i]
+                    piece_type = types[i]
+                    if piece_type == PAWN:
+                        origins = []
+                        if SQUARE_RANKS[square] >= 2 and not occupied >> (square - 8) & 1:
+                            origins.append(square - 8)
+                            if SQUARE_RANKS[square] == 3 and not occupied >> (square - 16) & 1:
+                                origins.append(square - 16)
+                    elif piece_type & 4:
+                        origins = []
+                        for ray in SLIDER_RAYS[piece_type][square]:
+                            for origin in ray:
+                                if occupied >> origin & 1:
+                                    break
+                                origins.append(origin)
+                    elif piece_type == KING:
+                        origins = [origin for origin in KING_SQUARES[square] if not occupied >> origin & 1 and
+                                   origin not in KING_SQUARES[squares[1]]]
+                    else:
+                        origins = [origin for origin in KNIGHT_SQUARES[square] if not occupied >> origin & 1]
+
+                    for origin in origins:
+                        moved = list(squares)
+                        moved[i] = origin
+                        moved_occupied = occupied ^ (1 << square | 1 << origin)
+                        if is_attacked(moved[1], moved, types, moved_occupied ^ 1 << moved[1]):
+                            continue  # The weak king can't be in check with the strong side to move.
+                        strong_index = get_index(moved)
+                        if not strong_table[strong_index]:
+                            strong_table[strong_index] = distance + 2
+                            strong_frontier.append(strong_index)
+
+            distance += 1
+            for strong_index in pending.pop(distance, []):
+                if not strong_table[strong_index]:
+                    strong_table[strong_index] = distance + 1
+                    strong_frontier.append(strong_index)
+
+            weak_frontier = []
+            for strong_index in strong_frontier:
+                squares = ending.getSquares(strong_index)
+                occupied = 0
+                for square in squares:
+                    occupied |= 1 << square
+
+                # Take back every weak king move that could have led here.
+                for origin in KING_SQUARES[squares[1]]:
+                    if occupied >> origin & 1 or origin in KING_SQUARES[squares[0]]:
+                        continue
+                    moved = list(squares)
+                    moved[1] = origin
+                    weak_index = get_index(moved)
+                    if weak_table[weak_index]:
+                        continue
+                    result = weakResult(moved)
+                    if result is None:
+                        continue
+                    if result == distance + 1:
+                        weak_table[weak_index] = result + 1
+                        weak_frontier.append(weak_index)
+                    else:
+                        pending.setdefault(result, []).append(weak_index)
+
+            distance += 1
+            for weak_index in pending.pop(distance, []):
+                if not weak_table[weak_index]:
+                    weak_table[weak_index] = distance + 1
+                    weak_frontier.append(weak_index)
+
+            if distance > 250:
+                raise ValueError('%s: distance to mate too long to store' % name)
+
+        self.tables[name] = (ending, strong_table, weak_table)
+        if verbose:
+            print('%s: %d positions, longest mate %d plies, %.1f s' % (name, size, max(strong_table) - 1,
+                                                                      time.time() - start))
+
+    def write(self, path, names):
+        """ Writes the tables of the endings to a tablebase file. """
+        names = sorted(names)
+        offset = TABLEBASE_HEADER.size + len(names) * TABLEBASE_ENTRY.size
+        with open(path, 'wb') as tablebase_file:
+            tablebase_file.write(TABLEBASE_HEADER.pack(TABLEBASE_MAGIC, TABLEBASE_VERSION, len(names)))
+            for name in names:
+                ending = self.tables[name][0]
+                tablebase_file.write(TABLEBASE_ENTRY.pack(name.encode('ascii'), offset, ending.getSize()))
+                offset += 2 * ending.getSize()
+            for name in names:
+                ending, strong_table, weak_table = self.tables[name]
+                tablebase_file.write(strong_table)
+                tablebase_file.write(weak_table)
+
+
+class Tablebase(object):
+
+    def __init__(self, path):
+        """ Opens a tablebase file. Raises IOError if it can't be read and ValueError if it isn't a tablebase. """
+        self.path = path
+        self.tablebase_file = open(path, 'rb')
+        try:
+            self.memory = mmap.mmap(self.tablebase_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.tablebase_file.close()
+            raise ValueError('not a tablebase file: %r' % path)
+
+        magic, version, count = TABLEBASE_HEADER.unpack_from(self.memory, 0)
+        if magic != TABLEBASE_MAGIC or version != TABLEBASE_VERSION:
+            self.close()
+            raise ValueError('not a tablebase file: %r' % path)
+
+        self.endings = {}  # Ending name to an (ending, offset) pair.
+        self.max_pieces = 0
+        for i in range(count):
+            name, offset, size = TABLEBASE_ENTRY.unpack_from(self.memory, TABLEBASE_HEADER.size +
+                                                             i * TABLEBASE_ENTRY.size)
+            ending = Ending(name.rstrip(b'\0').decode('ascii'))
+            self.endings[ending.getName()] = (ending, offset)
+            self.max_pieces = max(self.max_pieces, len(ending.types))
+
+    def close(self):
+        """ Closes the tablebase file. """
+        self.memory.close()
+        self.tablebase_file.close()
+
+    def getPath(self):
+        return self.path
+
+    def getEndings(self):
+        """ Returns the names of the endings in the tablebase. """
+        return sorted(self.endings)
+
+    def probe(self, board, player):
+        """ Returns a (result, distance to mate in plies) pair for the player to move, or None if the position
+            isn't in the tablebase. The result is TABLEBASE_WIN, TABLEBASE_DRAW or TABLEBASE_LOSS.
+        """
+        white = board.getOccupancy(WHITE)
+        black = board.getOccupancy(BLACK)
+        if bin(white | black).count('1') > self.max_pieces:
+            return None
+
+        # One side must have a bare king.
+        if black & (black - 1) == 0:
+            strong_player = board.getWhitePlayer()
+        elif white & (white - 1) == 0:
+            strong_player = board.getBlackPlayer()
+        else:
+            return None
+
+        # Squares as the tables count them, with the strong side playing up the board.
+        white_strong = strong_player.getColor() == WHITE
+        piece_dict = strong_player.getPieceDict()
+        piece_types = []
+        squares = [piece_dict[KING][0].getPosition(), board.getOtherPlayer(strong_player).getPieceDict()[KING][0]
+                   .getPosition()]
+        for piece_type in ENDING_PIECES:
+            for piece in piece_dict[piece_type]:
+                piece_types.append(piece_type)
+                squares.append(piece.getPosition())
+        squares = [((7 - (square >> 4)) if white_strong else (square >> 4)) * 8 + (square & 7) for square in squares]
+
+        name = endingName(piece_types)
+        if name not in self.endings:
+            return None
+        ending, offset = self.endings[name]
+
+        if player != strong_player:
+            offset += ending.getSize()
+        value = self.memory[offset + ending.getIndex(squares)]
+        if not value:
+            return TABLEBASE_DRAW, 0
+        elif player == strong_player:
+            return TABLEBASE_WIN, value - 1
+        else:
+            return TABLEBASE_LOSS, value - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate endgame tablebases.')
+    parser.add_argument('endings', nargs='*', default=list(TABLEBASE_ENDINGS),
+                        help='endings to generate, e.g. KQK KBNK (default: %s)' % ' '.join(TABLEBASE_ENDINGS))
+    parser.add_argument('--output', default=TABLEBASE_FILE,
+                        help='tablebase file to write (default: %s)' % TABLEBASE_FILE)
+    args = parser.parse_args()
+
+    generator = TablebaseGenerator()
+    for name in args.endings:
+        try:
+            generator.generate(name.upper(), verbose=True)
+        except ValueError as error:
+            parser.error(str(error))
+
+    generator.write(args.output, generator.getTables())
+
+
+if __name__ == '__main__':
+    main()